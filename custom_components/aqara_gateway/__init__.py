@@ -1,11 +1,14 @@
 """ Aqara Gateway """
+import copy
 import logging
 import math
+from typing import Optional
+
 import voluptuous as vol
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import MAJOR_VERSION, MINOR_VERSION
-from homeassistant.core import HomeAssistant, Event
+from homeassistant.core import HomeAssistant, Event, callback
 from homeassistant.exceptions import ConfigEntryNotReady
 from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.entity import Entity
@@ -13,15 +16,41 @@ from homeassistant.helpers.entity_registry import EntityRegistry
 from homeassistant.helpers.system_info import async_get_system_info
 from homeassistant.helpers.device_registry import CONNECTION_NETWORK_MAC
 
-from .core.gateway import Gateway
+from .core.gateway import Gateway, get_devices_store
 from .core.utils import AqaraGatewayDebug
-from .core.const import DOMAINS, DOMAIN, CONF_DEBUG
+from .core.const import (
+    DOMAINS,
+    DOMAIN,
+    CONF_DEBUG,
+    CONF_MQTT_BATCH_SIZE,
+    CONF_MQTT_CLIENT,
+    CONF_MQTT_QUEUE_SIZE,
+    CONF_RECORD,
+    CONF_RECORD_SIZE,
+    CONF_WRITE_BACKLOG,
+    CONF_WRITE_RATE,
+    CONF_WRITE_TIMEOUT,
+    CONF_WRITE_WINDOW,
+    MQTT_CLIENTS
+)
 
 _LOGGER = logging.getLogger(__name__)
 
 CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.Schema({
         vol.Optional(CONF_DEBUG): cv.string,
+        vol.Optional(CONF_MQTT_BATCH_SIZE): cv.positive_int,
+        vol.Optional(CONF_MQTT_QUEUE_SIZE): cv.positive_int,
+        vol.Optional(CONF_MQTT_CLIENT): vol.In(MQTT_CLIENTS),
+        vol.Optional(CONF_WRITE_WINDOW): vol.All(
+            vol.Coerce(float), vol.Range(min=0, max=1)),
+        vol.Optional(CONF_WRITE_RATE): vol.All(
+            vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(CONF_WRITE_BACKLOG): cv.positive_int,
+        vol.Optional(CONF_WRITE_TIMEOUT): vol.All(
+            vol.Coerce(float), vol.Range(min=0.1)),
+        vol.Optional(CONF_RECORD): cv.string,
+        vol.Optional(CONF_RECORD_SIZE): cv.positive_int,
     }, extra=vol.ALLOW_EXTRA),
 }, extra=vol.ALLOW_EXTRA)
 
@@ -118,6 +147,11 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     ])
 
 
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry):
+    """ Remove the stored device list of the entry """
+    await get_devices_store(hass, entry.entry_id).async_remove()
+
+
 def gateway_state_property(func):
     """Wrap a state property of an gateway entity.
     This checks if the state object in the entity is set, and
@@ -190,6 +224,14 @@ async def _setup_logger(hass: HomeAssistant):
 class GatewayGenericDevice(Entity):
     # pylint: disable=too-many-instance-attributes
     """ Gateway Generic Device """
+    # payload keys which update uses besides the attribute, the reports
+    # without them are not passed to update. None is for all payloads
+    _update_keys = None
+    # the state last written, the writes of an update which change nothing
+    # are skipped and counted
+    _in_update = False
+    _written = None
+    writes_suppressed = 0
 
     def __init__(self, gateway: Gateway, device: dict, attr: str):
         self.gateway = gateway
@@ -206,19 +248,67 @@ class GatewayGenericDevice(Entity):
         self.entity_id = f"{DOMAIN}.{self._unique_id}"
         self.entity_id = self.entity_id.replace(' ', '_').replace(':', '').lower()
 
-    def debug(self, message: str):
-        """ debug function """
-        self.gateway.debug(f"{self.entity_id} | {message}")
+    def debug(self, message: str, *args):
+        """ debug function, formatted with the args only if debug is on """
+        if self.gateway.debug_basic:
+            self.gateway.debug(f"{self.entity_id} | {message}", *args,
+                               did=self.device['did'])
 
     async def async_added_to_hass(self):
         """ added to hass """
         if 'init' in self.device:
             self.update(self.device['init'])
-        self.gateway.add_update(self.device['did'], self.update)
+        self.gateway.add_update(
+            self.device['did'], self._handle_update, self.update_keys)
 
     async def async_will_remove_from_hass(self) -> None:
         """Also run when rename entity_id"""
-        self.gateway.remove_update(self.device['did'], self.update)
+        self.gateway.remove_update(self.device['did'], self._handle_update)
+
+    def _handle_update(self, data: dict):
+        """ update from the gateway, the writes without changes are skipped """
+        self._in_update = True
+        try:
+            self.update(data)
+        finally:
+            self._in_update = False
+
+    def _state_snapshot(self) -> tuple:
+        """ the state and the attributes which are written """
+        # deep copies, a nested attribute value may change in place
+        return copy.deepcopy((
+            self.available, self.state, self.state_attributes,
+            self.extra_state_attributes, self.capability_attributes,
+            self.name, self.icon, self.entity_picture,
+            self.unit_of_measurement, self.device_class,
+            self.supported_features, self.assumed_state,
+        ))
+
+    @callback
+    def async_write_ha_state(self) -> None:
+        """ write the state, skip it in an update if nothing changed """
+        snapshot = self._state_snapshot()
+        if (self._in_update and not self.force_update
+                and snapshot == self._written):
+            self.writes_suppressed += 1
+            return
+        super().async_write_ha_state()
+        # only after the write, a failed write is not skipped next time
+        self._written = snapshot
+
+    def schedule_update_ha_state(self, force_refresh: bool = False) -> None:
+        """ write in place in an update, it runs in the event loop """
+        if self._in_update and not force_refresh:
+            self.async_write_ha_state()
+            return
+        super().schedule_update_ha_state(force_refresh)
+
+    @property
+    def update_keys(self) -> Optional[set]:
+        """ payload keys which update uses, None for all """
+        if self._update_keys is None:
+            return None
+        return {self._attr, *self._update_keys}
 
     @property
     def should_poll(self) -> bool:
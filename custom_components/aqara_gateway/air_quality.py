@@ -41,18 +41,18 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """ Perform the setup for Xiaomi/Aqara devices. """
     def setup(gateway: Gateway, device: dict, attr: str):
         if attr == 'tvoc_level':
-            async_add_entities([GatewayTvocSensor(gateway, device, attr)])
+            return [GatewayTvocSensor(gateway, device, attr)]
         else:
-            async_add_entities([GatewayAirMonitorSensor(
-                gateway, device, attr)])
+            return [GatewayAirMonitorSensor(gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('air_quality', setup)
+    aqara_gateway.add_setup('air_quality', setup, async_add_entities)
 
 
 class GatewayAirMonitorSensor(GatewayGenericDevice, AirQualityEntity):
     # pylint: disable=too-many-instance-attributes
     """Representation of a Xiaomi/Aqara Air Quality Monitor."""
+    _update_keys = (BATTERY, CHIP_TEMPERATURE, LQI, FW_VER, VOLTAGE)
 
     def __init__(self, gateway, device, attr):
         """Initialize the entity."""
@@ -182,6 +182,7 @@ class GatewayAirMonitorSensor(GatewayGenericDevice, AirQualityEntity):
 
 class GatewayTvocSensor(GatewayAirMonitorSensor, AirQualityEntity):
     """Air Quality class for Aqara TVOC device."""
+    _update_keys = (*GatewayAirMonitorSensor._update_keys, 'tvoc')
 
     def __init__(self, gateway, device, attr):
         """Initialize the entity."""
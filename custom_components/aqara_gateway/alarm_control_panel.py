@@ -1,5 +1,7 @@
 """ Aqara Gateway Alarm Control Panel """
 
+from functools import partial
+
 from homeassistant.components.alarm_control_panel import (
     AlarmControlPanelEntity,
     AlarmControlPanelEntityFeature,
@@ -9,7 +11,6 @@ from homeassistant.components.alarm_control_panel import (
 from . import DOMAIN, GatewayGenericDevice
 from .core.gateway import Gateway
 from .core.utils import Utils
-from .core.shell import TelnetShell, TelnetShellE1, TelnetShellM2POE, TelnetShellG3
 
 ALARM_STATES = [AlarmControlPanelState.ARMED_HOME, AlarmControlPanelState.ARMED_AWAY,
                 AlarmControlPanelState.ARMED_NIGHT, AlarmControlPanelState.DISARMED]
@@ -19,11 +20,11 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up the Aqara Gateway Alarm Control Panael platform."""
     def setup(gateway: Gateway, device: dict, attr: str):
         if Utils.gateway_alarm_mode_supported(device['model']):
-            async_add_entities([AqaraGatewayAlarm(
-                gateway, device, attr)], True)
+            return [AqaraGatewayAlarm(gateway, device, attr)]
 
     gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    gateway.add_setup('alarm_control_panel', setup)
+    gateway.add_setup('alarm_control_panel', setup,
+                      partial(async_add_entities, update_before_add=True))
 
 
 async def async_unload_entry(hass, entry):
@@ -36,7 +37,6 @@ class AqaraGatewayAlarm(GatewayGenericDevice, AlarmControlPanelEntity):
     """Representation of a Aqara Gateway Alarm."""
     _attr_alarm_state = AlarmControlPanelState.DISARMED
     _state = None
-    _shell = None
 
     def __init__(
         self,
@@ -45,19 +45,6 @@ class AqaraGatewayAlarm(GatewayGenericDevice, AlarmControlPanelEntity):
         attr
     ):
         """Initialize the Alarm Panel."""
-        device_name = Utils.get_device_name(device['model']).lower()
-        if "e1" in device_name:
-            self._shell = TelnetShellE1(gateway.host)
-        elif (("m2 2022" in device_name) or ("m1s 2022" in device_name) or
-                    ("m3" in device_name) or ("m1s gen2" in device_name) or
-                    ("v1" in device_name)):
-            self._shell = TelnetShellM2POE(gateway.host)
-        elif (("m100" in device_name) or ("m200" in device_name)):
-            self._shell = TelnetShellG3(gateway.host)
-        else:
-            self._shell = TelnetShell(gateway.host)
-        self._shell.login()
-        self._get_state()
         super().__init__(gateway, device, attr)
         self._attr_supported_features = (AlarmControlPanelEntityFeature.ARM_HOME |
                 AlarmControlPanelEntityFeature.ARM_AWAY | AlarmControlPanelEntityFeature.ARM_NIGHT)
@@ -65,9 +52,7 @@ class AqaraGatewayAlarm(GatewayGenericDevice, AlarmControlPanelEntity):
     @property
     def should_poll(self):
         """return should poll."""
-        if self._shell:
-            return True
-        return False
+        return True
 
     @property
     def icon(self):
@@ -91,49 +76,51 @@ class AqaraGatewayAlarm(GatewayGenericDevice, AlarmControlPanelEntity):
     async def async_will_remove_from_hass(self) -> None:
         """remove from hass."""
 
-    def alarm_disarm(self, code=None):
+    async def async_alarm_disarm(self, code=None):
         """Send disarm command."""
-        self._set_state(3)
+        await self._async_set_state(3)
 
-    def alarm_arm_home(self, code=None):
+    async def async_alarm_arm_home(self, code=None):
         """Send arm home command."""
-        self._set_state(0)
+        await self._async_set_state(0)
 
-    def alarm_arm_away(self, code=None):
+    async def async_alarm_arm_away(self, code=None):
         """Send arm away command."""
-        self._set_state(1)
+        await self._async_set_state(1)
 
-    def alarm_arm_night(self, code=None):
+    async def async_alarm_arm_night(self, code=None):
         """Send arm night command."""
-        self._set_state(2)
+        await self._async_set_state(2)
 
-    def _set_state(self, state):
+    async def _async_set_state(self, state):
         if state in range(0, 3):
-            self._shell.set_prop('persist.app.arming_state', str(state))
             value = 'true'
             command = "-arm -g"
         else:
             value = 'false'
             command = "-arm -u"
-        self._shell.set_prop('persist.app.arming_guard', value)
-        self._shell.run_basis_cli(command)
+        async with self.gateway.shell_pool.borrow() as shell:
+            if state in range(0, 3):
+                await shell.set_prop('persist.app.arming_state', str(state))
+            await shell.set_prop('persist.app.arming_guard', value)
+            await shell.run_basis_cli(command)
         self._state = ALARM_STATES[state]
-        self.schedule_update_ha_state()
+        self.async_write_ha_state()
 
-    def _get_state(self):
+    async def _async_get_state(self):
         self._attr_alarm_state = AlarmControlPanelState.DISARMED
-        raw = self._shell.get_prop('persist.app.arming_guard')
-        if raw == 'true':
-            raw = self._shell.get_prop('persist.app.arming_state')
+        async with self.gateway.shell_pool.borrow() as shell:
+            raw = await shell.get_prop('persist.app.arming_guard')
+            if raw != 'true':
+                return
+            raw = await shell.get_prop('persist.app.arming_state')
             if raw is not ["0", "1", "2", "3"]:
-                raw = self._shell.get_prop('persist.app.arming_state')
-            try:
-                self._state = ALARM_STATES[int(raw)]
-            except:
-                self._state = 0
-
+                raw = await shell.get_prop('persist.app.arming_state')
+        try:
+            self._state = ALARM_STATES[int(raw)]
+        except:
+            self._state = 0
 
-    def update(self, *args):
+    async def async_update(self):
         """Update the alarm status."""
-        self._get_state()
-        self.schedule_update_ha_state()
+        await self._async_get_state()
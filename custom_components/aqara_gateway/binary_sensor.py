@@ -55,34 +55,35 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """ Perform the setup for Xiaomi/Aqara devices. """
     def setup(gateway: Gateway, device: dict, attr: str):
         if attr == 'action':
-            async_add_entities([GatewayAction(gateway, device, attr)])
+            return [GatewayAction(gateway, device, attr)]
         elif attr == 'switch':
-            async_add_entities([GatewayButtonSwitch(gateway, device, attr)])
+            return [GatewayButtonSwitch(gateway, device, attr)]
         elif attr == 'contact':
-            async_add_entities([GatewayDoorSensor(gateway, device, attr)])
+            return [GatewayDoorSensor(gateway, device, attr)]
         elif attr == 'gas':
-            async_add_entities([GatewayNatgasSensor(gateway, device, attr)])
+            return [GatewayNatgasSensor(gateway, device, attr)]
         elif attr == 'smoke':
-            async_add_entities([GatewaySmokeSensor(gateway, device, attr)])
+            return [GatewaySmokeSensor(gateway, device, attr)]
         elif attr == 'motion':
-            async_add_entities([GatewayMotionSensor(gateway, device, attr)])
+            return [GatewayMotionSensor(gateway, device, attr)]
         elif attr == 'moisture':
-            async_add_entities([GatewaWaterLeakSensor(gateway, device, attr)])
+            return [GatewaWaterLeakSensor(gateway, device, attr)]
         elif attr == 'door_state':  # door state
-            async_add_entities([GatewayLockDoorState(gateway, device, attr)])
+            return [GatewayLockDoorState(gateway, device, attr)]
         elif attr in ['auto locking', 'lock by handle']:  # lock state
-            async_add_entities([GatewayLockLockState(gateway, device, attr)])
+            return [GatewayLockLockState(gateway, device, attr)]
         elif attr == 'latch_state':  # latch state
-            async_add_entities([GatewayLockLatchState(gateway, device, attr)])
+            return [GatewayLockLatchState(gateway, device, attr)]
         else:
-            async_add_entities([GatewayBinarySensor(gateway, device, attr)])
+            return [GatewayBinarySensor(gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('binary_sensor', setup)
+    aqara_gateway.add_setup('binary_sensor', setup, async_add_entities)
 
 
 class GatewayBinarySensor(GatewayGenericDevice, BinarySensorEntity):
     """Representation of a Xiaomi/Aqara Binary Sensor."""
+    _update_keys = ()
     _state = False
     _battery = None
     _chip_temperature = None
@@ -126,6 +127,7 @@ class GatewayBinarySensor(GatewayGenericDevice, BinarySensorEntity):
 
 class GatewayNatgasSensor(GatewayBinarySensor, BinarySensorEntity):
     """Representation of a Xiaomi/Aqara Natgas Sensor."""
+    _update_keys = (GAS_DENSITY, CHIP_TEMPERATURE, FW_VER, LQI)
 
     def __init__(
         self,
@@ -176,6 +178,9 @@ class GatewayNatgasSensor(GatewayBinarySensor, BinarySensorEntity):
 
 class GatewayMotionSensor(GatewayBinarySensor):
     """Representation of a Xiaomi/Aqara Motion Sensor."""
+    _update_keys = (
+        BATTERY, CHIP_TEMPERATURE, NO_CLOSE, LQI, VOLTAGE, ELAPSED_TIME,
+        'illuminance')
 
     def __init__(
         self,
@@ -323,6 +328,7 @@ class GatewayMotionSensor(GatewayBinarySensor):
 class GatewayDoorSensor(GatewayBinarySensor, BinarySensorEntity):
     # pylint: disable=too-many-instance-attributes
     """Representation of a Xiaomi/Aqara Door Sensor."""
+    _update_keys = (BATTERY, CHIP_TEMPERATURE, NO_CLOSE, LQI, VOLTAGE)
 
     def __init__(
         self,
@@ -394,6 +400,7 @@ class GatewayDoorSensor(GatewayBinarySensor, BinarySensorEntity):
 
 class GatewaWaterLeakSensor(GatewayBinarySensor, BinarySensorEntity):
     """Representation of a Xiaomi/Aqara Water Leak Sensor."""
+    _update_keys = (BATTERY, CHIP_TEMPERATURE, LQI, VOLTAGE)
 
     def __init__(
         self,
@@ -458,6 +465,7 @@ class GatewaWaterLeakSensor(GatewayBinarySensor, BinarySensorEntity):
 
 class GatewaySmokeSensor(GatewayBinarySensor, BinarySensorEntity):
     """Representation of a Xiaomi/Aqara Smoke Sensor."""
+    _update_keys = (SMOKE_DENSITY, CHIP_TEMPERATURE, VOLTAGE, FW_VER, LQI)
 
     def __init__(
         self,
@@ -514,6 +522,8 @@ class GatewaySmokeSensor(GatewayBinarySensor, BinarySensorEntity):
 
 class GatewayButtonSwitch(GatewayBinarySensor, BinarySensorEntity):
     """ Xiaomi/Aqara Button Switch """
+    # the buttons are matched by prefix
+    _update_keys = None
 
     def __init__(
         self,
@@ -614,6 +624,8 @@ class GatewayButtonSwitch(GatewayBinarySensor, BinarySensorEntity):
 
 class GatewayAction(GatewayBinarySensor, BinarySensorEntity):
     """ Xiaomi/Aqara Action Cube """
+    # the actions and scenes are matched by prefix
+    _update_keys = None
 
     def __init__(
         self,
@@ -747,6 +759,7 @@ class GatewayLockDoorState(GatewayBinarySensor):
     Door state of an Aqara Door Lock.
     _attr: 'door_state'
     """
+    _update_keys = ('lock', 'door')
 
     # Get door state from 'door_state' attr
     # True means open, False means closed
@@ -780,6 +793,7 @@ class GatewayLockLockState(GatewayBinarySensor):
     Lock state of an Aqara Door Lock.
     _attr: 'auto locking' or 'lock by handle'
     """
+    _update_keys = ('door',)
 
     @property
     def device_class(self):
@@ -801,6 +815,7 @@ class GatewayLockLatchState(GatewayBinarySensor):
     Latch state of an Aqara Door Lock.
     _attr: 'latch_state'
     """
+    _update_keys = ('door',)
 
     @property
     def device_class(self):
@@ -10,10 +10,10 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """Perform the setup for Aqara buttons."""
 
     def setup(gateway: Gateway, device: dict, attr: str):
-        async_add_entities([GatewayButton(gateway, device, attr)])
+        return [GatewayButton(gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('button', setup)
+    aqara_gateway.add_setup('button', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -24,6 +24,7 @@ async def async_unload_entry(hass, entry):
 
 class GatewayButton(GatewayGenericDevice, ButtonEntity):
     """Representation of an Aqara button entity."""
+    _update_keys = ()
 
     @property
     def icon(self):
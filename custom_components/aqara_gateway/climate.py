@@ -34,20 +34,16 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """Perform the setup for Xiaomi/Aqara devices."""
     def setup(gateway: Gateway, device: dict, attr: str):
         if attr == 'yuba':
-            async_add_entities([
-                AqaraClimateYuba(gateway, device, attr)])
+            return [AqaraClimateYuba(gateway, device, attr)]
         elif attr == 'towel_warmer':
-            async_add_entities([AqaraTowelWarmer(gateway, device, attr)])
+            return [AqaraTowelWarmer(gateway, device, attr)]
         elif device.get('model') in VRF_MODELS:
-            async_add_entities([
-                AqaraVRFClimate(gateway, device, attr)])
+            return [AqaraVRFClimate(gateway, device, attr)]
         else:
-            async_add_entities([
-                AqaraGenericClimate(gateway, device, attr)
-            ])
+            return [AqaraGenericClimate(gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('climate', setup)
+    aqara_gateway.add_setup('climate', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -184,7 +180,7 @@ class AqaraGenericClimate(GatewayGenericDevice, ClimateEntity):
     def set_temperature(self, **kwargs) -> None:
         """ set temperature """
         if not self._state or kwargs[ATTR_TEMPERATURE] == 0:
-            self.debug(f"Can't set climate temperature: {self._state}")
+            self.debug("Can't set climate temperature: %s", self._state)
             return
         self._state[2] = int(kwargs[ATTR_TEMPERATURE])
         state = int.from_bytes(self._state, 'big')
@@ -232,6 +228,11 @@ class AqaraVRFClimate(GatewayGenericDevice, ClimateEntity):
             self.index = int(attr.split()[-1])
         except (ValueError, IndexError):
             self.index = 1
+        self._update_keys = (
+            f'current_temperature_{self.index}',
+            f'target_temperature_{self.index}', f'power_{self.index}',
+            f'mode_{self.index}', f'fan_mode_{self.index}', 'back_version',
+            'sn_code')
 
         self._attr_hvac_mode = HVACMode.OFF
         self._attr_hvac_modes = [
@@ -421,7 +422,7 @@ class AqaraClimateYuba(AqaraGenericClimate, ClimateEntity):
     def set_temperature(self, **kwargs) -> None:
         """ set temperature """
         if not self._state or kwargs[ATTR_TEMPERATURE] == 0:
-            self.debug(f"Can't set climate temperature: {self._state}")
+            self.debug("Can't set climate temperature: %s", self._state)
             return
         self.gateway.send(self.device, {'target_temperature': 100 * int(kwargs[ATTR_TEMPERATURE])})
         self._target_temp = int(kwargs[ATTR_TEMPERATURE])
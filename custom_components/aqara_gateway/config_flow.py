@@ -1,7 +1,7 @@
 """Config flow to configure aqara gateway component."""
+import asyncio
 from collections import OrderedDict
 from typing import Optional
-import socket
 
 import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
@@ -21,7 +21,8 @@ from .core import gateway
 from .core.const import (
     DOMAIN, OPT_DEVICE_NAME, CONF_MODEL, OPT_DEBUG,
     CONF_DEBUG, CONF_STATS, CONF_NOFFLINE, SUPPORTED_MODELS,
-    CONF_PATCHED_FW, CONF_VRF_UNITS, VRF_DIP_MIN, VRF_DIP_MAX
+    CONF_PATCHED_FW, CONF_VRF_UNITS, VRF_DIP_MIN, VRF_DIP_MAX,
+    CONF_THROTTLE_INTERVAL, CONF_THROTTLE_DELTA
 )
 from .core.utils import Utils
 
@@ -59,12 +60,12 @@ class AqaraGatewayFlowHandler(ConfigFlow, domain=DOMAIN):
                 return self.async_abort(reason="connection_error")
             if self._token and self._model in ('m1s', 'p3', 'h1', 'e1'):
                 Utils.enable_telnet(self._host, self._token)
-            if not self._check_port(23):
+            if not await self._check_port(23):
                 return self.async_abort(reason="connection_error")
-            ret = gateway.is_aqaragateway(self._host,
-                                            self._password,
-                                            self._model,
-                                            self._patched_fw)
+            ret = await gateway.is_aqaragateway(self._host,
+                                                self._password,
+                                                self._model,
+                                                self._patched_fw)
             if "error" in ret['status']:
                 return self.async_abort(reason="connection_error")
             self._name = ret.get('name', '')
@@ -137,13 +138,15 @@ class AqaraGatewayFlowHandler(ConfigFlow, domain=DOMAIN):
             },
         )
 
-    def _check_port(self, port: int):
+    async def _check_port(self, port: int):
         """Check if gateway port open."""
-        skt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            return skt.connect_ex((self._host, port)) == 0
-        finally:
-            skt.close()
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self._host, port), timeout=5)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
 
     async def async_step_discovery_confirm(self, user_input=None):
         """Handle user-confirmation of discovered node."""
@@ -233,7 +236,7 @@ class AqaraGatewayFlowHandler(ConfigFlow, domain=DOMAIN):
         if model not in SUPPORTED_MODELS:
             return self.async_abort(reason="connection_error")
 
-        if not self._check_port(23):
+        if not await self._check_port(23):
             return self.async_abort(reason="connection_error")
 
 
@@ -274,6 +277,8 @@ class OptionsFlowHandler(OptionsFlow):
             self._token = user_input.get(CONF_TOKEN, "")
             self._debug = user_input.get(CONF_DEBUG, [])
             self._noffline = user_input.get(CONF_NOFFLINE, True)
+            self._throttle_interval = user_input.get(CONF_THROTTLE_INTERVAL, 0)
+            self._throttle_delta = user_input.get(CONF_THROTTLE_DELTA, 0)
             # Proceed to VRF config step
             return await self.async_step_vrf()
 
@@ -283,6 +288,9 @@ class OptionsFlowHandler(OptionsFlow):
         self._model = self.config_entry.options.get(CONF_MODEL, '')
         debug = self.config_entry.options.get(CONF_DEBUG, [])
         ignore_offline = self.config_entry.options.get(CONF_NOFFLINE, True)
+        throttle_interval = self.config_entry.options.get(
+            CONF_THROTTLE_INTERVAL, 0)
+        throttle_delta = self.config_entry.options.get(CONF_THROTTLE_DELTA, 0)
 
         return self.async_show_form(
             step_id="init",
@@ -295,6 +303,18 @@ class OptionsFlowHandler(OptionsFlow):
                         OPT_DEBUG
                     ),
                     vol.Required(CONF_NOFFLINE, default=ignore_offline): bool,
+                    vol.Optional(
+                        CONF_THROTTLE_INTERVAL, default=throttle_interval
+                    ): NumberSelector(NumberSelectorConfig(
+                        min=0, max=3600, step=1,
+                        unit_of_measurement="s",
+                        mode=NumberSelectorMode.BOX)),
+                    vol.Optional(
+                        CONF_THROTTLE_DELTA, default=throttle_delta
+                    ): NumberSelector(NumberSelectorConfig(
+                        min=0, max=100, step=0.1,
+                        unit_of_measurement="%",
+                        mode=NumberSelectorMode.BOX)),
                 }
             ),
         )
@@ -329,6 +349,8 @@ class OptionsFlowHandler(OptionsFlow):
                     CONF_MODEL: self._model,
                     CONF_DEBUG: self._debug,
                     CONF_NOFFLINE: self._noffline,
+                    CONF_THROTTLE_INTERVAL: self._throttle_interval,
+                    CONF_THROTTLE_DELTA: self._throttle_delta,
                     CONF_VRF_UNITS: vrf_units,
                 },
             )
@@ -39,6 +39,47 @@ CONF_STATS = "stats"
 CONF_NOFFLINE = "noffline"
 CONF_PATCHED_FW = "patched_firmware"
 
+# inbound mqtt messages, queued by the paho thread and handled in batches
+CONF_MQTT_BATCH_SIZE = "mqtt_batch_size"
+CONF_MQTT_QUEUE_SIZE = "mqtt_queue_size"
+DEFAULT_MQTT_BATCH_SIZE = 100
+DEFAULT_MQTT_QUEUE_SIZE = 2000
+
+# paho runs a network thread per gateway, asyncio runs in the event loop
+CONF_MQTT_CLIENT = "mqtt_client"
+MQTT_CLIENTS = ('paho', 'asyncio')
+
+# fast reported attributes are held to an interval in seconds, a change of
+# the delta in percent passes at once
+CONF_THROTTLE_INTERVAL = "throttle_interval"
+CONF_THROTTLE_DELTA = "throttle_delta"
+
+# seconds the writes of a device are merged into one, a scene sets several
+# attributes of a device within a few ms. Off by default, 0 sends every
+# write at once
+CONF_WRITE_WINDOW = "write_window"
+DEFAULT_WRITE_WINDOW = 0
+
+# the writes are published at most rate a second with bursts of
+# WRITE_BURST, interactive ones ahead of the background config writes
+CONF_WRITE_RATE = "write_rate"
+CONF_WRITE_BACKLOG = "write_backlog"
+DEFAULT_WRITE_RATE = 10
+DEFAULT_WRITE_BACKLOG = 500
+WRITE_BURST = 5
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# seconds to wait for the write_rsp of a device
+CONF_WRITE_TIMEOUT = "write_timeout"
+DEFAULT_WRITE_TIMEOUT = 10
+
+# the received mqtt messages are recorded to the folder (relative to the
+# config folder), a file of record_size MB is rotated
+CONF_RECORD = "record"
+CONF_RECORD_SIZE = "record_size"
+DEFAULT_RECORD_SIZE = 10
+
 OPT_DEBUG = {
     'true': "Basic logs",
     'mqtt': "MQTT logs"
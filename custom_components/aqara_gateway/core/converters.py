@@ -0,0 +1,90 @@
+""" Converters of the reported param values to the hass values """
+from typing import Callable, Dict, Optional, Tuple
+
+# returned by a converter if the value is dropped from the payload
+SKIP = object()
+
+
+def xiaomi_battery(value: int) -> int:
+    """Convert battery voltage to battery percent."""
+    if value <= 100:
+        return value
+    if value <= 2700:
+        return 0
+    if value >= 3200:
+        return 100
+    return int((value - 2700) / 5)
+
+
+def xiaomi_voltage(value: int) -> float:
+    """Convert voltage to battery percent."""
+    if value <= 1000:
+        return round(value * 1000.0, 2)
+    return value
+
+
+def convert_param(param: dict):
+    """ default converter, the value or the arguments of an event """
+    if 'value' in param:
+        value = param['value']
+        # Strip control characters from VRF string values
+        if isinstance(value, str):
+            value = value.rstrip('\x00\x08\b')
+        return value
+    if 'arguments' in param:
+        return param['arguments']
+    return SKIP
+
+
+def _raw(param: dict):
+    return param['value']
+
+
+def _temperature(param: dict):
+    value = param['value']
+    return value / 100.0 if -4000 < value < 12500 else SKIP
+
+
+def _humidity(param: dict):
+    value = param['value']
+    return value / 100.0 if 0 <= value <= 10000 else SKIP
+
+
+def _motion(param: dict):
+    if 'value' in param:
+        return convert_param(param)
+    return 1 if 'arguments' in param else SKIP
+
+
+# (attr, model, cloud): converter, None of model or cloud matches any.
+# https://github.com/Koenkk/zigbee2mqtt/issues/798
+# https://www.maero.dk/aqara-temperature-humidity-pressure-sensor-teardown/
+CONVERTERS: Dict[Tuple[str, Optional[str], Optional[str]], Callable] = {
+    ('temperature', None, None): _temperature,
+    ('temperature', 'lumi.airmonitor.acn01', 'miot'): _raw,
+    ('temperature', 'aqara.tow_w.acn001', None): _raw,
+    ('humidity', None, None): _humidity,
+    ('humidity', 'lumi.airmonitor.acn01', 'miot'): _raw,
+    ('pressure', None, None): lambda param: param['value'] / 100.0,
+    # I do not know if the formula is correct, so battery is more
+    # important than voltage
+    ('battery', None, None): lambda param: xiaomi_battery(param['value']),
+    ('voltage', None, None): lambda param: xiaomi_voltage(param['value']),
+    # xiaomi cube 100 points = 360 degrees
+    ('angle', None, None): lambda param: param['value'] * 4,
+    # xiaomi cube
+    ('duration', None, None): lambda param: param['value'] / 1000.0,
+    ('power', None, None): lambda param: round(param['value'], 2),
+    ('consumption', None, None):
+        lambda param: round(param['value'], 2) / 1000.0,
+    ('motion', None, None): _motion,
+}
+
+
+def get_converter(attr: str, model: str, cloud: str) -> Callable:
+    """ return the converter of the attr, the most specific one wins """
+    for key in ((attr, model, cloud), (attr, model, None),
+                (attr, None, cloud), (attr, None, None)):
+        if key in CONVERTERS:
+            return CONVERTERS[key]
+    return convert_param
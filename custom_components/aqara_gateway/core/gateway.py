@@ -1,12 +1,16 @@
 """ Aqara Gateway """
 import asyncio
+import copy
+from collections import deque
+from functools import partial
 # pylint: disable=broad-except
 import logging
+import os
 import socket
 import time
 import json
 import re
-from typing import Optional
+from typing import Callable, Optional
 from random import randint
 from paho.mqtt.client import Client, MQTTMessage
 from datetime import datetime
@@ -15,14 +19,26 @@ from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import Event, HomeAssistant
 from homeassistant.const import CONF_NAME, CONF_PASSWORD, CONF_HOST, MAJOR_VERSION, MINOR_VERSION
 from homeassistant.components.light import ATTR_HS_COLOR, ATTR_RGB_COLOR, ATTR_BRIGHTNESS
-
+from homeassistant.helpers.storage import Store
+
+from .converters import SKIP, convert_param
+from .mqtt import AsyncClient
+from .recorder import Recorder
+from .outbound import (
+    OutboundQueue,
+    PendingWrites,
+    WriteCoalescer,
+    call_in_loop
+)
 from .shell import (
+    ShellPool,
     TelnetShell,
     TelnetShellG2H,
     TelnetShellE1,
     TelnetShellG3,
     TelnetShellM2POE
 )
+from .throttle import Throttle
 from .utils import DEVICES, Utils, GLOBAL_PROP
 from .const import (
     CONF_MODEL,
@@ -37,11 +53,52 @@ from .const import (
     MD5_MOSQUITTO_MIPSEL,
     VRF_MODELS,
     VRF_DIP_MIN,
-    VRF_DIP_MAX
+    VRF_DIP_MAX,
+    CONF_MQTT_BATCH_SIZE,
+    CONF_MQTT_CLIENT,
+    CONF_MQTT_QUEUE_SIZE,
+    CONF_RECORD,
+    CONF_RECORD_SIZE,
+    CONF_THROTTLE_DELTA,
+    CONF_THROTTLE_INTERVAL,
+    CONF_WRITE_BACKLOG,
+    CONF_WRITE_RATE,
+    CONF_WRITE_TIMEOUT,
+    CONF_WRITE_WINDOW,
+    DEFAULT_MQTT_BATCH_SIZE,
+    DEFAULT_MQTT_QUEUE_SIZE,
+    DEFAULT_RECORD_SIZE,
+    DEFAULT_WRITE_BACKLOG,
+    DEFAULT_WRITE_RATE,
+    DEFAULT_WRITE_TIMEOUT,
+    DEFAULT_WRITE_WINDOW,
+    PRIORITY_INTERACTIVE,
+    WRITE_BURST
 )
 
+try:
+    from orjson import loads as json_loads  # faster, used when installed
+except ImportError:
+    json_loads = json.loads
+
 _LOGGER = logging.getLogger(__name__)
 
+# properties read from the gateway while loading the devices
+GATEWAY_PROPS = (
+    'sys.zb_coordinator', 'sys.zb_device', 'persist.sys.model',
+    'ro.sys.model', 'persist.sys.did', 'ro.sys.fw_ver', 'ro.sys.build_num',
+    'ro.sys.vendor', 'persist.sys.zb_ver', 'persist.sys.sn',
+    'persist.sys.miio_mac', 'persist.sys.cloud',
+)
+
+# version of the stored device list of the gateway
+STORAGE_VERSION = 1
+
+
+def get_devices_store(hass: HomeAssistant, entry_id: str) -> Store:
+    """ the store of the device list of the config entry """
+    return Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}.devices")
+
 
 class Gateway:
     # pylint: disable=too-many-instance-attributes, unused-argument
@@ -60,24 +117,80 @@ class Gateway:
 
         self._config_entry = entry
 
-        self._mqttc = Client()
+        self._mqtt_async = (config or {}).get(CONF_MQTT_CLIENT) == 'asyncio'
+        if self._mqtt_async:
+            self._mqttc = AsyncClient(hass.loop)
+        else:
+            self._mqttc = Client()
         self._mqttc.on_connect = self.on_connect
         self._mqttc.on_disconnect = self.on_disconnect
         self._mqttc.on_message = self.on_message
 
-        self._debug = self.options.get('debug', '')  # for fast access
+        # the debug categories, checked before a message is made
+        debug = self.options.get('debug', '')
+        self.debug_basic = 'true' in debug
+        self.debug_mqtt = 'mqtt' in debug
         self.parent_scan_interval = (-1 if self.options.get('parent') is None
                                         else self.options['parent'])
         self.default_devices = config['devices'] if config else None
 
+        # messages of the paho thread, handled in batches in the event loop
+        config = config or {}
+        self._inbox = deque()
+        self._inbox_size = config.get(
+            CONF_MQTT_QUEUE_SIZE, DEFAULT_MQTT_QUEUE_SIZE)
+        self._inbox_batch_size = config.get(
+            CONF_MQTT_BATCH_SIZE, DEFAULT_MQTT_BATCH_SIZE)
+        self._inbox_scheduled = False
+        self.inbox_dropped = 0  # messages dropped as the queue was full
+        self.inbox_overflows = 0  # batches left over for the next round
+
+        # the writes of a device within the window are sent as one
+        window = config.get(CONF_WRITE_WINDOW, DEFAULT_WRITE_WINDOW)
+        self._outbound = WriteCoalescer(
+            hass.loop, window, self._publish_write) if window > 0 else None
+        rate = config.get(CONF_WRITE_RATE, DEFAULT_WRITE_RATE)
+        self.outbound_queue = OutboundQueue(
+            hass.loop, rate, WRITE_BURST,
+            config.get(CONF_WRITE_BACKLOG, DEFAULT_WRITE_BACKLOG),
+            self._mqttc.publish) if rate > 0 else None
+        # capture of the received messages for tools/replay.py
+        record = config.get(CONF_RECORD)
+        self._recorder = Recorder(
+            hass, os.path.join(hass.config.path(record),
+                               f"mqtt_{self.host}.rec"),
+            config.get(CONF_RECORD_SIZE, DEFAULT_RECORD_SIZE) * 1024 * 1024
+        ) if record else None
+        # the writes sent, matched with write_ack and write_rsp by id
+        self.pending_writes = PendingWrites(
+            hass.loop, config.get(CONF_WRITE_TIMEOUT, DEFAULT_WRITE_TIMEOUT),
+            self._publish)
+
         self.devices = {}
         self.updates = {}
+        self._update_filters = {}  # did: {handler: payload keys}
+        interval = self.options.get(CONF_THROTTLE_INTERVAL, 0)
+        self._throttle = Throttle(
+            hass.loop, interval, self.options.get(CONF_THROTTLE_DELTA, 0),
+            self._dispatch_update) if interval > 0 else None
         self.setups = {}
+        self._add_entities = {}
+        self._setup_events = {}
+        self.cold_start_time = None  # seconds from start to fully working
         self._extra_state_attributes = {}
         self._info_ts = None
         self._gateway_did = ''
         self._model = self.options.get(CONF_MODEL, '')  # long model, will replace to short later
         self.cloud = 'aiot'  # for fast access
+        self.shell_pool = ShellPool(self._create_shell)
+        # the subscribed topics, the payload is decoded once and passed on
+        self._topic_handlers = {
+            'zigbee/send': self._process_message,
+            'ioctl/send': self._process_message,
+            'ioctl/recv': self._process_message,
+            'debug/host': self._process_message,
+        }
+        self._store = get_devices_store(hass, entry.entry_id)
 
     @property
     def device(self):
@@ -85,26 +198,109 @@ class Gateway:
         return self.devices[list(self.devices)[0]]
 #        return self.devices['lumi.0']
 
-    def add_update(self, did: str, handler):
-        """Add handler to device update event."""
+    def add_update(self, did: str, handler, keys=None):
+        """Add handler to device update event.
+
+        The handler is called only for the payloads with one of the keys,
+        None is for all payloads.
+        """
         self.updates.setdefault(did, []).append(handler)
+        if keys is not None:
+            self._update_filters.setdefault(did, {})[handler] = frozenset(keys)
 
     def remove_update(self, did: str, handler):
         """remove update"""
         self.updates.setdefault(did, []).remove(handler)
+        self._update_filters.get(did, {}).pop(handler, None)
+
+    def _dispatch_update(self, did: str, payload: dict, everyone=False):
+        """ call the handlers of the device which use the payload """
+        filters = self._update_filters.get(did, {})
+        for handler in self.updates.get(did, ()):
+            keys = filters.get(handler)
+            if everyone or keys is None or not keys.isdisjoint(payload):
+                handler(payload)
+
+    def add_topic(self, topic: str, handler):
+        """Add handler of the mqtt topic, subscribe it if connected."""
+        self._topic_handlers[topic] = handler
+        if self.available and not self.debug_mqtt:
+            self._mqttc.subscribe(topic)
+
+    def remove_topic(self, topic: str):
+        """Remove handler of the mqtt topic and unsubscribe it."""
+        if self._topic_handlers.pop(topic, None) is None:
+            return
+        if self.available and not self.debug_mqtt:
+            self._mqttc.unsubscribe(topic)
+
+    def add_setup(self, domain: str, handler, async_add_entities):
+        """Add hass device setup funcion.
 
-    def add_setup(self, domain: str, handler):
-        """Add hass device setup funcion."""
+        The handler returns the entities of the attribute of the device, they
+        are added to hass with async_add_entities in one call per platform.
+        """
         self.setups[domain] = handler
+        self._add_entities[domain] = async_add_entities
+        self._setup_event(domain).set()
+
+    def _setup_entities(self, entities: dict, domain: str, device: dict,
+                        attr: str):
+        """ collect the entities of the platform for the attribute """
+        entities.setdefault(domain, []).extend(
+            self.setups[domain](self, device, attr) or [])
+
+    def _add_collected_entities(self, entities: dict):
+        """ add the collected entities, one call per platform """
+        for domain, domain_entities in entities.items():
+            if domain_entities:
+                self._add_entities[domain](domain_entities)
+        entities.clear()
+
+    def _setup_event(self, domain: str) -> asyncio.Event:
+        """ the event is set when the platform of the domain is ready """
+        if domain not in self._setup_events:
+            self._setup_events[domain] = asyncio.Event()
+        return self._setup_events[domain]
+
+    async def _wait_setup(self, domain: str, timeout: float,
+                          entities: dict = None) -> bool:
+        """ wait the platform of the domain, return False on timeout
+
+        The collected entities are added before waiting, so they do not wait
+        for a platform which is not ready.
+        """
+        if domain in self.setups:
+            return True
+        if entities:
+            self._add_collected_entities(entities)
+        try:
+            await asyncio.wait_for(
+                self._setup_event(domain).wait(), max(timeout, 0))
+            return True
+        except asyncio.TimeoutError:
+            return False
 
-    def debug(self, message: str):
-        """ deubug function """
-        if 'true' in self._debug:
-            _LOGGER.debug(f"{self.host}: {message}")
+    def debug(self, message: str, *args, did: str = None):
+        """Debug function, the message is formatted with the args only if
+        the basic debug is on. The host and did go to the debug records."""
+        if self.debug_basic:
+            _LOGGER.debug(f"{self.host}: {message}", *args,
+                          extra={'host': self.host, 'did': did})
 
     def stop(self):
         """ stop function """
         self.enabled = False
+        self.shell_pool.close()
+        if self._throttle:
+            self._throttle.cancel()
+        if self._outbound:
+            self._outbound.cancel()
+        self.pending_writes.cancel()
+        if self._recorder:
+            self._recorder.close()
+        if self.outbound_queue:
+            self.outbound_queue.cancel()
 
         if self.main_task:  # HA < 2023.3
             self.main_task.cancel()
@@ -113,11 +309,14 @@ class Gateway:
         """Connect to the host. Does not process messages yet."""
         result: int | None = None
         try:
-            result = await self.hass.async_add_executor_job(
-                self._mqttc.connect,
-                self.host
-            )
-        except OSError as err:
+            if self._mqtt_async:
+                result = await self._mqttc.async_connect(self.host)
+            else:
+                result = await self.hass.async_add_executor_job(
+                    self._mqttc.connect,
+                    self.host
+                )
+        except (OSError, asyncio.TimeoutError) as err:
             _LOGGER.error(
                 f"Failed to connect to MQTT server {self.host} due to exception: {err}")
 
@@ -138,7 +337,10 @@ class Gateway:
             # Do not disconnect, we want the broker to always publish will
             self._mqttc.loop_stop()
 
-        await self.hass.async_add_executor_job(stop)
+        if self._mqtt_async:
+            stop()
+        else:
+            await self.hass.async_add_executor_job(stop)
 
     def start(self):
         hass = self.hass
@@ -150,14 +352,22 @@ class Gateway:
 
     async def async_run(self):
         """ Main thread loop. """
+        start = time.monotonic()
         telnetshell = False
         if "telnet" not in self.hass.data[DOMAIN]:
             self.hass.data[DOMAIN]["telnet"] = []
         if "mqtt" not in self.hass.data[DOMAIN]:
             self.hass.data[DOMAIN]["mqtt"] = []
 
+        # entities are created from the last device list at once, the list
+        # read from the gateway reconciles them when telnet answers
+        cache_task = None
+        if not self.devices:  # not again when run after a disconnect
+            cache_task = self.hass.create_task(
+                self._async_setup_cached_devices())
+
         while not self.enabled and not self.available:
-            if not self._check_port(23):
+            if not await self._check_port(23):
                 if self.host in self.hass.data[DOMAIN]["telnet"]:
                     self.hass.data[DOMAIN]["telnet"].remove(self.host)
                 _LOGGER.error(f"Can not connecto the telnet of the gateway ({self.host})!")
@@ -165,11 +375,24 @@ class Gateway:
                 continue
 
             telnetshell = True
-            devices = self._prepare_gateway(get_devices=True)
-            if isinstance(devices, list):
+            result = await self._prepare_gateway(get_devices=True)
+            if isinstance(result, tuple):
+                devices, complete = result
                 if len(devices) >= 1:
                     self._gw_topic = "gw/{}/".format(devices[0]['mac'][2:].upper())
-                await self.async_setup_devices(devices)
+                # a partial list must not replace the stored devices nor
+                # remove the devices missing from it
+                if complete:
+                    await self._async_save_devices(devices)
+                if cache_task is not None and \
+                        await self._async_cached_devices_done(cache_task):
+                    await self._async_reconcile_devices(
+                        devices, prune=complete)
+                else:
+                    # a failed stored setup may have added some of them
+                    await self.async_setup_devices([
+                        device for device in devices
+                        if device['did'] not in self.devices])
                 break
 
         if telnetshell:
@@ -178,10 +401,10 @@ class Gateway:
 
         while not self.available:
             self._mqttc.loop_stop()
-            if not self._mqtt_connect():
+            if not await self._async_mqtt_connect():
                 if self.host in self.hass.data[DOMAIN]["mqtt"]:
                     self.hass.data[DOMAIN]["mqtt"].remove(self.host)
-                if not self._prepare_gateway():
+                if not await self._prepare_gateway():
                     _LOGGER.error(f"Can not connecto the mqtt of the gateway ({self.host})!")
                     await asyncio.sleep(30)
                     continue
@@ -194,20 +417,93 @@ class Gateway:
             if self.host not in self.hass.data[DOMAIN]["mqtt"]:
                 self.hass.data[DOMAIN]["mqtt"].append(self.host)
 
-    def _mqtt_connect(self) -> bool:
+        if self.cold_start_time is None:
+            self.cold_start_time = time.monotonic() - start
+            _LOGGER.info(f"Gateway {self.host} started in "
+                         f"{self.cold_start_time:.1f}s")
+
+    async def _async_setup_cached_devices(self) -> bool:
+        """ set up the devices stored by the last run, True if any """
+        # pylint: disable=broad-except
+        try:
+            data = await self._store.async_load()
+        except Exception as expt:
+            self.debug("Can't load the stored devices: %s", expt)
+            return False
+        if not data or not data.get('devices'):
+            return False
+
+        devices = data['devices']
+        self.debug("Set up %d devices from the storage", len(devices))
+        self._model = data.get('model') or self._model
+        self.cloud = data.get('cloud') or self.cloud
+        self._gw_topic = "gw/{}/".format(devices[0]['mac'][2:].upper())
+        await self.async_setup_devices(copy.deepcopy(devices))
+        return True
+
+    async def _async_cached_devices_done(self, cache_task) -> bool:
+        """ wait for the setup of the stored devices, True if it is done
+
+        A failed setup is only logged, the devices of the gateway are then
+        set up as without a stored list.
+        """
+        # pylint: disable=broad-except
+        try:
+            return await cache_task
+        except Exception as expt:
+            _LOGGER.warning(f"Can't set up the stored devices of "
+                            f"{self.host}: {expt}")
+            return False
+
+    async def _async_save_devices(self, devices: list):
+        """ store the devices read from the gateway for the next start
+
+        Only the raw list of the gateway is stored, the descriptors are
+        resolved again from the device catalog when the list is loaded.
+        """
+        await self._store.async_save({
+            'model': self._model,
+            'cloud': self.cloud,
+            'devices': copy.deepcopy(devices),
+        })
+
+    async def _async_reconcile_devices(self, devices: list,
+                                      prune: bool = True):
+        """ add the new devices and remove the gone ones if prune """
+        dids = [device['did'] for device in devices]
+        if not dids:
+            # the gateway did not answer well, keep the stored devices
+            return
+        gone = [did for did in self.devices if did not in dids] \
+            if prune else []
+        for did in gone:
+            self.debug("%s is not in the gateway anymore", did, did=did)
+            self.devices.pop(did)
+            if did.startswith('lumi.'):
+                Utils.remove_device(self.hass, did)
+        await self.async_setup_devices([
+            device for device in devices if device['did'] not in self.devices
+        ])
+
+    async def _async_mqtt_connect(self) -> bool:
+        # pylint: disable=broad-except
         try:
-            self._mqttc.reconnect()
+            if self._mqtt_async:
+                return await self._mqttc.async_reconnect() == 0
+            await self.hass.async_add_executor_job(self._mqttc.reconnect)
             return True
         except Exception:
             return False
 
-    def _check_port(self, port: int):
+    async def _check_port(self, port: int):
         """Check if gateway port open."""
-        skt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            return skt.connect_ex((self.host, port)) == 0
-        finally:
-            skt.close()
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, port), timeout=5)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
 
     @staticmethod
     def _parse_device_conf(raw: str) -> dict:
@@ -238,109 +534,111 @@ class Gateway:
                                     self.options.get(CONF_PASSWORD, ''))
         return shell
 
-    def _prepare_gateway(self, get_devices: bool = False):
+    async def _create_shell(self) -> TelnetShell:
+        """ create the shell of the gateway for the shell pool """
+        device_name = Utils.get_device_name(self._model).lower()
+        if len(device_name) <= 1:
+            shell = TelnetShell(self.host,
+                                    self.options.get(CONF_PASSWORD, ''))
+            try:
+                device_name = await shell.get_model()
+            finally:
+                shell.close()
+        return self._get_shell(device_name)
+
+    async def _prepare_gateway(self, get_devices: bool = False):
         """Launching the required utilities on the hub, if they are not already
         running.
         """
         try:
-            device_name = Utils.get_device_name(self._model).lower()
-            if len(device_name) <= 1:
-                shell = TelnetShell(self.host,
-                                        self.options.get(CONF_PASSWORD, ''))
-                device_name = shell.get_model()
-                shell.close()
-            shell = self._get_shell(device_name)
-
-            shell.login()
+            async with self.shell_pool.borrow() as shell:
+                processes = await shell.get_running_ps("mosquitto")
+                public_mosquitto = await shell.check_public_mosquitto()
 
-            processes = shell.get_running_ps("mosquitto")
-            public_mosquitto = shell.check_public_mosquitto()
+                if (not public_mosquitto and
+                        "/data/bin/mosquitto" not in processes):
+                    self.debug("mosquitto is not running as public!")
+                    await shell.run_public_mosquitto(self._model)
+                    processes = await shell.get_running_ps("mosquitto")
 
-            if not public_mosquitto and "/data/bin/mosquitto" not in processes:
-                self.debug("mosquitto is not running as public!")
-                shell.run_public_mosquitto(self._model)
-                processes = shell.get_running_ps("mosquitto")
+                if "mosquitto" not in processes:
+                    if not public_mosquitto:
+                        if "/data/bin/mosquitto" not in processes:
+                            await shell.run_public_mosquitto(self._model)
 
-            if "mosquitto" not in processes:
-                if not public_mosquitto:
-                    if "/data/bin/mosquitto" not in processes:
-                        shell.run_public_mosquitto(self._model)
-
-            if get_devices:
-                devices = self._get_devices(shell)
-                shell.close()
-                return devices
-            return True
+                if get_devices:
+                    return await self._get_devices(shell)
+                return True
 
         except (ConnectionRefusedError, socket.timeout):
             return False
 
         except Exception as expt:
-            self.debug("Can't read devices: {}".format(expt))
+            self.debug("Can't read devices: %s", expt)
             return False
 
-    def _get_devices(self, shell):
-        """Load devices info for Coordinator, Zigbee and Mesh."""
+    async def _get_devices(self, shell):
+        """Load devices info for Coordinator, Zigbee and Mesh.
+
+        Return the devices and False if the list is partial because a file
+        could not be read or parsed.
+        """
         devices = []
+        complete = False
 
         try:
             # 1. Read coordinator info
             value = {}
             version_g2h = ""
             build_num_g2h = ""
-            prop_raw = shell.get_prop("")
-
-            data = re.search(r"\[sys\.zb_coordinator\\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-            zb_coordinator = data.group(1) if data else shell.get_prop("sys.zb_coordinator")
-            data = re.search(r"\[persist\.sys\.model\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-            model = data.group(1) if data else shell.get_prop("persist.sys.model")
-            if len(model) < 1:
-                data = re.search(r"\[ro\.sys\.model\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                model = data.group(1) if data else shell.get_prop("ro.sys.model")
+            props = await shell.get_props(GATEWAY_PROPS)
+            zb_coordinator = props['sys.zb_coordinator']
+            zb_device = props['sys.zb_device']
+            # read every file which may be needed in one round trip
+            paths = list(dict.fromkeys(filter(None, [
+                '/mnt/config/miio/device.conf', '/etc/build.prop',
+                zb_coordinator, '/data/zigbee/coordinator.info',
+                '/mnt/config/zigbee/coordinator.info',
+                zb_device, '/data/zigbee/device.info',
+                '/mnt/config/zigbee/device.info'])))
+            files = dict(zip(paths, await shell.read_files(paths)))
+
+            model = props['persist.sys.model'] or props['ro.sys.model']
             if len(model) < 1:
                 device_conf = self._parse_device_conf(
-                    str(shell.read_file('/mnt/config/miio/device.conf')))
+                    files['/mnt/config/miio/device.conf'])
                 did = device_conf.get('did', '')
                 model = device_conf.get('model', '')
             if len(zb_coordinator) >= 1:
-                raw = shell.read_file(zb_coordinator, with_newline=False)
-                data = re.search(r"\[persist\.sys\.did\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                did = data.group(1) if data else shell.get_prop("persist.sys.did")
-                data = re.search(r"\[persist\.sys\.model\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                model = data.group(1) if data else shell.get_prop("ro.sys.model")
+                raw = files[zb_coordinator]
+                did = props['persist.sys.did']
+                model = props['persist.sys.model'] or props['ro.sys.model']
             elif any(name in model for name in [
                     'lumi.gateway', 'lumi.aircondition',
                     'lumi.camera.gwpagl01', 'lumi.camera.agl001',
                     'lumi.camera.acn003', 'lumi.camera.acn008', 'lumi.camera.acn009',
                     'lumi.camera.acn010', 'lumi.camera.acn011', 'lumi.gateway.agl011']):
-                raw = shell.read_file(
-                    '/data/zigbee/coordinator.info', with_newline=False)
-                data = re.search(r"\[persist\.sys\.did\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                did = data.group(1) if data else shell.get_prop("persist.sys.did")
-                data = re.search(r"\[persist\.sys\.model\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                model = data.group(1) if data else shell.get_prop("persist.sys.model")
+                raw = files['/data/zigbee/coordinator.info']
+                did = props['persist.sys.did']
+                model = props['persist.sys.model']
             elif any(name in model for name in ['lumi.camera.gwagl02', 'lumi.camera.gwag03']):
-                raw = str(shell.read_file('/mnt/config/miio/device.conf'))
+                raw = files['/mnt/config/miio/device.conf']
                 if len(raw) <= 1:
-                    raw = str(shell.read_file('/mnt/config/miio/device.conf'))
+                    raw = str(await shell.read_file('/mnt/config/miio/device.conf'))
                 device_conf = self._parse_device_conf(raw)
                 did = device_conf.get('did', '')
                 model = device_conf.get('model', '')
-                raw = str(shell.read_file('/etc/build.prop'))
+                raw = files['/etc/build.prop']
                 if len(raw) >= 1:
                     data = re.search(r"ro.sys.fw_ver=([0-9]+).+", raw)
                     version_g2h = data.group(1) if data else ''
                     data = re.search(r"ro.sys.build_num=([0-9]+).+", raw)
                     build_num_g2h = data.group(1) if data else ''
-                raw = shell.read_file(
-                    '/mnt/config/zigbee/coordinator.info', with_newline=False)
+                raw = files['/mnt/config/zigbee/coordinator.info']
             else:
-                raw = shell.read_file(
-                    '/data/zigbee/coordinator.info', with_newline=False)
-                data = re.search(r"\[persist\.sys\.did\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                did = data.group(1) if data else shell.get_prop("persist.sys.did")
-                data = re.search(r"\[ro\.sys\.model\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                model = data.group(1) if data else shell.get_prop("ro.sys.model")
+                raw = files['/data/zigbee/coordinator.info']
+                did = props['persist.sys.did']
+                model = props['ro.sys.model']
             value = json.loads(raw)
             devices = [{
                 'coordinator': 'lumi.0',
@@ -354,63 +652,52 @@ class Gateway:
                 'type': 'gateway',
             }]
 
-            if len(prop_raw) >= 1:
-                data = re.search(r"\[ro\.sys\.model\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                hw_model = data.group(1) if data else shell.get_prop("ro.sys.model")
-                data = re.search(r"\[ro\.sys\.fw_ver\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                version = data.group(1) if data else shell.get_prop("ro.sys.fw_ver")
-                data = re.search(r"\[ro\.sys\.build_num\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                build_num = data.group(1) if data else shell.get_prop("ro.sys.build_num")
-                data = re.search(r"\[ro\.sys\.vendor\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                device_manufacturer = data.group(1) if data else shell.get_prop("ro.sys.vendor")
-                data = re.search(r"\[persist\.sys\.zb_ver\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                zb_ver = data.group(1) if data else shell.get_prop("persist.sys.zb_ver")
-                data = re.search(r"\[persist\.sys\.sn\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                serial_number = data.group(1) if data else shell.get_prop("persist.sys.sn")
-                data = re.search(r"\[persist\.sys\.miio_mac\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                mac = data.group(1) if data else shell.get_prop("persist.sys.miio_mac")
-
-                if len(device_manufacturer) >= 1:
-                    devices[0]['device_manufacturer'] = f"{device_manufacturer}"
-                if len(hw_model) >= 1:
-                    devices[0]['hw_version'] = f"{hw_model}"
-                if len(version) >= 1 and len(build_num) >= 1:
-                    devices[0]['sw_version'] = f"{version}_{build_num}"
-                elif len(version_g2h) >=1 and len(build_num_g2h) >= 1:
-                    devices[0]['sw_version'] = f"{version_g2h}_{build_num_g2h}"
-                if len(zb_ver) >= 1:
-                    devices[0]['sw_version'] = f"{devices[0]['sw_version']}.{zb_ver}"
-                if len(serial_number) >= 1:
-                    devices[0]['serial_number'] = f"{serial_number}"
-                if len(mac) >= 1:
-                    devices[0]['mac'] = f"{mac}"
+            hw_model = props['ro.sys.model']
+            version = props['ro.sys.fw_ver']
+            build_num = props['ro.sys.build_num']
+            device_manufacturer = props['ro.sys.vendor']
+            zb_ver = props['persist.sys.zb_ver']
+            serial_number = props['persist.sys.sn']
+            mac = props['persist.sys.miio_mac']
+
+            if len(device_manufacturer) >= 1:
+                devices[0]['device_manufacturer'] = f"{device_manufacturer}"
+            if len(hw_model) >= 1:
+                devices[0]['hw_version'] = f"{hw_model}"
+            if len(version) >= 1 and len(build_num) >= 1:
+                devices[0]['sw_version'] = f"{version}_{build_num}"
+            elif len(version_g2h) >=1 and len(build_num_g2h) >= 1:
+                devices[0]['sw_version'] = f"{version_g2h}_{build_num_g2h}"
+            if len(zb_ver) >= 1 and 'sw_version' in devices[0]:
+                devices[0]['sw_version'] = f"{devices[0]['sw_version']}.{zb_ver}"
+            if len(serial_number) >= 1:
+                devices[0]['serial_number'] = f"{serial_number}"
+            if len(mac) >= 1:
+                devices[0]['mac'] = f"{mac}"
 
             self._model = model
 
             # zigbee devices
-            data = re.search(r"\[sys\.zb_device\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-            zb_device = data.group(1) if data else shell.get_prop("sys.zb_device")
             if len(zb_device) >= 1:
-                raw = shell.read_file(zb_device, with_newline=False)
+                raw = files[zb_device]
             else:
-                device_info_path = '{}/zigbee/device.info'.format(Utils.get_info_store_path(self._model))
-                if not shell.file_exist(device_info_path):
-                    device_info_path = '/mnt/config/zigbee/device.info'
-                raw = shell.read_file(device_info_path)
+                raw = files['{}/zigbee/device.info'.format(
+                    Utils.get_info_store_path(self._model))]
+                if len(raw) < 1:
+                    raw = files['/mnt/config/zigbee/device.info']
 
             value = json.loads(raw)
             dev_info = value.get("devInfo", 'null') or []
             if not Utils.gateway_is_aiot_only(model):
-                self.cloud = shell.get_prop("persist.sys.cloud")
+                self.cloud = props['persist.sys.cloud']
 
             for dev in dev_info:
                 model = dev['model']
                 desc = Utils.get_device(model, self.cloud)
                 # skip unknown model
                 if desc is None:
-                    self.debug("{} has an unsupported model: {}".format(
-                        dev['did'], model
-                    ))
+                    self.debug("%s has an unsupported model: %s",
+                               dev['did'], model, did=dev['did'])
                     continue
                 device = {
                     'coordinator': 'lumi.0',
@@ -423,19 +710,24 @@ class Gateway:
                     'status': dev['status']
                 }
                 devices.append(device)
+            complete = True
         except Exception as e:
-            self.debug("Can't get devices: {}".format(e))
+            self.debug("Can't get devices: %s", e)
 
-        return devices
+        return devices, complete
 
     async def async_setup_devices(self, devices: list):
         """Add devices to hass."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        entities = {}
         for device in devices:
-            timeout = 300
+            # every device waits the platforms at most 300 seconds
+            deadline = loop.time() + 300
             if device['type'] in ('gateway', 'zigbee'):
                 desc = Utils.get_device(device['model'], self.cloud)
                 if not desc:
-                    self.debug("Unsupported model: {}".format(device))
+                    self.debug("Unsupported model: %s", device)
                     continue
 
                 device.update(desc)
@@ -452,6 +744,8 @@ class Gateway:
                 # Dynamically inject VRF climate params based on config
                 if device['model'] in VRF_MODELS:
                     vrf_units = self.options.get(CONF_VRF_UNITS, [])
+                    # the params of the description are shared by the model
+                    device['params'] = list(device['params'])
                     for idx_0, unit_id in enumerate(vrf_units):
                         if unit_id < VRF_DIP_MIN or unit_id > VRF_DIP_MAX:
                             continue
@@ -477,15 +771,17 @@ class Gateway:
                              f'climate {zone}', 'climate'],
                         ])
 
+                # compile once, used to decode every report of the device
+                device['resources'] = Utils.get_resource_index(
+                    device, self.cloud)
+                device['writes'] = Utils.get_write_index(device)
+
                 self.devices[device['did']] = device
 
                 if device['type'] == 'zigbee':
-                    last_seen_timeout = 300
-                    while 'sensor' not in self.setups and last_seen_timeout > 0:
-                        await asyncio.sleep(1)
-                        last_seen_timeout = last_seen_timeout - 1
-                    if 'sensor' in self.setups:
-                        self.setups['sensor'](self, device, 'last_seen')
+                    if await self._wait_setup('sensor', 300, entities):
+                        self._setup_entities(
+                            entities, 'sensor', device, 'last_seen')
 
                 for param in (device['params'] or device['mi_spec']):
                     domain = param[3]
@@ -493,20 +789,28 @@ class Gateway:
                         continue
 
                     # wait domain init
-                    while domain not in self.setups and timeout > 0:
-                        await asyncio.sleep(1)
-                        timeout = timeout - 1
+                    if not await self._wait_setup(
+                            domain, deadline - loop.time(), entities):
+                        self.debug("Platform %s is not ready, skip %s of %s",
+                                   domain, param[2], device['did'],
+                                   did=device['did'])
+                        continue
                     attr = param[2]
                     if (attr in ('illuminance', 'light') and
                             device['type'] == 'gateway'):
                         self._gateway_did = device['did']
 
-                    self.setups[domain](self, device, attr)
+                    self._setup_entities(entities, domain, device, attr)
 
             if self.options.get('stats'):
-                while 'sensor' not in self.setups:
-                    await asyncio.sleep(1)
-                self.setups['sensor'](self, device, device['type'])
+                if await self._wait_setup(
+                        'sensor', deadline - loop.time(), entities):
+                    self._setup_entities(
+                        entities, 'sensor', device, device['type'])
+
+        self._add_collected_entities(entities)
+        self.debug("Set up %d devices in %.3fs",
+                   len(devices), loop.time() - start)
 
     def add_stats(self, ieee: str, handler):
         """ add gateway stats """
@@ -519,16 +823,16 @@ class Gateway:
         """ remove gateway stats """
         self._extra_state_attributes.pop(ieee)
 
-    def process_gateway_stats(self, payload: dict = None):
+    async def process_gateway_stats(self, payload: dict = None):
         """ process gateway status """
         # empty payload - update available state
-        self.debug(f"gateway <= {payload or self.available}")
+        self.debug("gateway <= %s", payload or self.available)
 
         if 'lumi.0' not in self._extra_state_attributes:
             return
 
+        data = {}
         if payload:
-            data = {}
             for param in payload:
                 if 'networkUp' in param:
                     # {"networkUp":false}
@@ -560,12 +864,11 @@ class Gateway:
                             ':', 1) if 'time' in item else item.lstrip(
                                 ).strip().split(' '))
                         data.update(dict(zip(stat, stat)))
-            device_name = Utils.get_device_name(self._model).lower()
-            shell = self._get_shell(device_name)
-            shell.login()
-            raw = shell.read_file('{}/zigbee/networkBak.info'.format(
-                Utils.get_info_store_path(self._model)), with_newline=False)
-            shell.close()
+            async with self.shell_pool.borrow() as shell:
+                raw = await shell.read_file(
+                    '{}/zigbee/networkBak.info'.format(
+                        Utils.get_info_store_path(self._model)),
+                    with_newline=False)
             if len(raw) >= 1:
                 value = json.loads(raw)
                 data.update(value)
@@ -575,7 +878,12 @@ class Gateway:
     def on_connect(self, client, userdata, flags, ret):
         # pylint: disable=unused-argument
         """ on connect to mqtt server """
-        self._mqttc.subscribe("#")
+        if self.debug_mqtt:
+            # the raw mqtt debug shows all topics of the hub
+            topics = ['#']
+        else:
+            topics = list(self._topic_handlers)
+        self._mqttc.subscribe([(topic, 0) for topic in topics])
         self.available = True
         if self.host not in self.hass.data[DOMAIN]["mqtt"]:
             self.hass.data[DOMAIN]["mqtt"].append(self.host)
@@ -591,47 +899,59 @@ class Gateway:
         self.hass.create_task(self.async_run())
 
     def on_message(self, client: Client, userdata, msg: MQTTMessage):
-        self.hass.loop.call_soon_threadsafe(self._on_message, msg)
+        # pylint: disable=unused-argument
+        """ queue the message, the event loop is woken once per batch """
+        if len(self._inbox) >= self._inbox_size:
+            self.inbox_dropped += 1
+            return
+        self._inbox.append(msg)
+        if not self._inbox_scheduled:
+            self._inbox_scheduled = True
+            self.hass.loop.call_soon_threadsafe(self._process_inbox)
+
+    def _process_inbox(self):
+        """ handle the queued messages, at most one batch at a time """
+        # cleared first, a message queued from now on schedules a new round
+        self._inbox_scheduled = False
+        inbox = self._inbox
+        for _ in range(min(len(inbox), self._inbox_batch_size)):
+            self._on_message(inbox.popleft())
+        if inbox and not self._inbox_scheduled:
+            # let the other tasks run before the next batch
+            self.inbox_overflows += 1
+            self._inbox_scheduled = True
+            self.hass.loop.call_soon(self._process_inbox)
 
     def _on_message(self, msg: MQTTMessage):
         # pylint: disable=unused-argument
         """ on getting messages from mqtt server """
 
         topic = msg.topic
-        if topic == 'broker/ping':
-            return
+        handler = self._topic_handlers.get(topic)
 
-        if 'mqtt' in self._debug:
+        if self._recorder:
+            self._recorder.record(topic, msg.payload)
+
+        if self.debug_mqtt and self.debug_basic and topic != 'broker/ping':
             try:
-                self.debug("MQTT on_message: {} {}".format(
-                    topic, msg.payload.decode()))
+                self.debug("MQTT on_message: %s %s",
+                           topic, msg.payload.decode())
             except UnicodeDecodeError:
-                self.debug("MQTT on_message: {}".format(topic))
-                self.debug(msg.payload)
+                self.debug("MQTT on_message: %s %s", topic, msg.payload)
 
-        if topic == 'log/camera':
+        # drop the topics which are not handled, e.g. log/camera
+        if handler is None:
             return
 
         try:
-            json.loads(msg.payload)
+            payload = json_loads(msg.payload)
         except ValueError:
             self.debug("Decoding JSON failed")
             return
 
-        if topic == 'zigbee/send':
-            payload = json.loads(msg.payload)
-            self._process_message(payload)
-        elif topic == 'ioctl/send':
-            payload = json.loads(msg.payload)
-            self._process_message(payload)
-        elif topic == 'ioctl/recv':
-            payload = json.loads(msg.payload)
-            self._process_message(payload)
-        elif topic == 'debug/host':
-            payload = json.loads(msg.payload)
-            self._process_message(payload)
-
-    def _process_devices_info(self, prop, value):
+        handler(payload)
+
+    async def _process_devices_info(self, prop, value):
         if prop == 'removed_did' and value:
             Utils.remove_device(self.hass, value)
             if isinstance(value, dict) and value['did'] in self.devices:
@@ -641,17 +961,15 @@ class Gateway:
             return
 
         if prop == 'paring' and value == 0:
-            device_name = Utils.get_device_name(self._model).lower()
-            shell = self._get_shell(device_name)
-            shell.login()
-            zb_device = shell.get_prop("sys.zb_device")
-            if len(zb_device) >= 1:
-                raw = shell.read_file(zb_device, with_newline=False)
-            else:
-                raw = shell.read_file('{}/zigbee/device.info'.format(
-                    Utils.get_info_store_path(self._model)), with_newline=False)
-
-            shell.close()
+            async with self.shell_pool.borrow() as shell:
+                zb_device = await shell.get_prop("sys.zb_device")
+                if len(zb_device) >= 1:
+                    raw = await shell.read_file(zb_device, with_newline=False)
+                else:
+                    raw = await shell.read_file(
+                        '{}/zigbee/device.info'.format(
+                            Utils.get_info_store_path(self._model)),
+                        with_newline=False)
             value = json.loads(raw)
             dev_info = value.get("devInfo", 'null') or []
             for dev in dev_info:
@@ -659,9 +977,8 @@ class Gateway:
                 desc = Utils.get_device(model, self.cloud)
                 # skip unknown model
                 if desc is None:
-                    self.debug("{} has an unsupported model: {}".format(
-                        dev['did'], model
-                    ))
+                    self.debug("%s has an unsupported model: %s",
+                               dev['did'], model, did=dev['did'])
                     continue
 
                 if prop == 'paring':
@@ -693,7 +1010,13 @@ class Gateway:
             pkey = 'params' if 'params' in data else 'mi_spec'
         elif data['cmd'] in ('write_rsp', 'read_rsp'):
             pkey = 'results' if 'results' in data else 'mi_spec'
+            if data['cmd'] == 'write_rsp' and 'id' in data:
+                self.pending_writes.resolve(data['id'], all(
+                    param.get('error_code', param.get('code', 0)) == 0
+                    for param in data.get(pkey) or ()), data.get('did'))
         elif data['cmd'] == 'write_ack':
+            if 'id' in data:
+                self.pending_writes.ack(data['id'], data.get('did'))
             return
         elif data['cmd'] == 'behaved':
             return
@@ -716,24 +1039,20 @@ class Gateway:
                     if param.get('error_code', 0) != 0:
                         continue
                     prop = param.get('res_name', None)
-                    if prop in GLOBAL_PROP:
+                    if device:
+                        prop = device['resources'].get(prop, (prop,))[0]
+                    elif prop in GLOBAL_PROP:
                         prop = GLOBAL_PROP[prop]
-                    elif device:
-                        prop = next((
-                            p[2] for p in (device['params'])
-                            if p[0] == prop
-                        ), prop)
                     if prop in ('removed_did', 'paring'):
-                        self._process_devices_info(
-                            prop, param.get('value', None))
+                        self.hass.create_task(self._process_devices_info(
+                            prop, param.get('value', None)))
 #                        self._handle_device_remove({})
                         return
                     payload = {}
                     if (prop in ('illuminance', 'light', 'added_device')
                             and self._gateway_did in self.updates):
                         payload[prop] = param.get('value')
-                        for handler in self.updates[self._gateway_did]:
-                            handler(payload)
+                        self._dispatch_update(self._gateway_did, payload)
                         return
             elif pkey in ('control'):
                 payload = {}
@@ -743,14 +1062,13 @@ class Gateway:
                         data['data']['blue'] + data['data']['green'] * 256 + data['data']['red'] * 65536))
                     payload[ATTR_RGB_COLOR] = (data['data']['red'], data['data']['green'], data['data']['blue'])
                     payload[ATTR_BRIGHTNESS] = brightness
-                    for handler in self.updates[self._gateway_did]:
-                        handler(payload)
+                    self._dispatch_update(self._gateway_did, payload)
                 elif data.get('from', '') != 'ha':
                     _LOGGER.warning("Unsupported cmd: {}".format(data))
                 return
 
 
-            self.process_gateway_stats(data[pkey])
+            self.hass.create_task(self.process_gateway_stats(data[pkey]))
 
             return
 
@@ -761,7 +1079,8 @@ class Gateway:
         device = self.devices.get(did, None)
         if device is None:
             return
-        time_stamp = time.time()
+        resources = device['resources']
+        online = device.get('online', True)
 
         payload = {}
 
@@ -780,78 +1099,29 @@ class Gateway:
                 _LOGGER.warning("Unsupported param: %s", data)
                 return
 
-            # For VRF devices, prefer device-specific params over
-            # GLOBAL_PROP to avoid resource ID collisions (e.g.
-            # 4.10.85 mapped to 'channel_1_decoupled' globally but
-            # means 'power_3' for VRF).
-            if device.get('model') in VRF_MODELS:
-                device_prop = next((
-                    p[2] for p in (device['params'] or device['mi_spec'])
-                    if p[0] == prop
-                ), None)
-                if device_prop is not None:
-                    prop = device_prop
-                elif prop in GLOBAL_PROP:
-                    prop = GLOBAL_PROP[prop]
-            elif prop in GLOBAL_PROP:
-                prop = GLOBAL_PROP[prop]
-            else:
-                prop = next((
-                    p[2] for p in (device['params'] or device['mi_spec'])
-                    if p[0] == prop
-                ), prop)
-
-            # https://github.com/Koenkk/zigbee2mqtt/issues/798
-            # https://www.maero.dk/aqara-temperature-humidity-pressure-sensor-teardown/
-            if prop == 'temperature':
-                if device['model'] == 'lumi.airmonitor.acn01' and self.cloud == 'miot' or device['model'] == 'aqara.tow_w.acn001':
-                    payload[prop] = param['value']
-                elif -4000 < param['value'] < 12500:
-                        payload[prop] = param['value'] / 100.0
-            elif prop == 'humidity':
-                if device['model'] == 'lumi.airmonitor.acn01' and self.cloud == 'miot':
-                    payload[prop] = param['value']
-                elif 0 <= param['value'] <= 10000:
-                    payload[prop] = param['value'] / 100.0
-            elif prop == 'pressure':
-                payload[prop] = param['value'] / 100.0
-            elif prop == 'battery':
-                # I do not know if the formula is correct, so battery is more
-                # important than voltage
-                payload[prop] = Utils.fix_xiaomi_battery(param['value'])
-            elif prop == 'voltage':
-                payload[prop] = Utils.fix_xiaomi_voltage(param['value'])
-            elif prop == 'alive' and param['value']['status'] == 'offline':
+            # GLOBAL_PROP and the device params are merged at setup, with
+            # the converters of the model
+            prop, convert = resources.get(prop) or (prop, convert_param)
+
+            if prop == 'alive' and param['value']['status'] == 'offline':
                 if not self.options.get('noffline', False):
                     device['online'] = False
-            elif prop == 'angle':
-                # xiaomi cube 100 points = 360 degrees
-                payload[prop] = param['value'] * 4
-            elif prop == 'duration':
-                # xiaomi cube
-                payload[prop] = param['value'] / 1000.0
-            elif prop in ('power'):
-                payload[prop] = round(param['value'], 2)
-            elif prop in ('consumption'):
-                payload[prop] = round(param['value'], 2) / 1000.0
-            elif 'value' in param:
-                value = param['value']
-                # Strip control characters from VRF string values
-                if isinstance(value, str):
-                    value = value.rstrip('\x00\x08\b')
+                continue
+
+            value = convert(param)
+            if value is not SKIP:
                 payload[prop] = value
-            elif 'arguments' in param:
-                if prop == 'motion':
-                    payload[prop] = 1
-                else:
-                    payload[prop] = param['arguments']
 
-        self.debug("{} {} <= {} [{}]".format(
-            device['did'], device['model'], payload, time_stamp
-        ))
+        if self.debug_basic:
+            self.debug("%s %s <= %s [%s]", device['did'], device['model'],
+                       payload, time.time(), did=did)
 
-        for handler in self.updates[did]:
-            handler(payload)
+        if self._throttle:
+            self._throttle.process(did, payload)
+
+        # the availability of every entity changes with the online state
+        self._dispatch_update(
+            did, payload, everyone=online != device.get('online', True))
 
         if 'added_device' in payload:
             # {'did': 'lumi.fff', 'mac': 'fff', 'model': 'lumi.sen_ill.mgl01',
@@ -883,44 +1153,96 @@ class Gateway:
         self.hass.bus.async_listen(
             'device_registry_updated', device_registry_updated)
 
-    def send(self, device: dict, data: dict):
-        """ send command """
+    def _encode_write(self, device: dict, did: str, data: dict,
+                      msg_id: int):
+        """Encode the write of the hass attrs with the write index of the
+        device, the attrs without a lumi resource are skipped."""
+        writes = device.get('writes')
+        if writes is None:
+            writes = device['writes'] = Utils.get_write_index(device)
+        params = []
+        for key, val in data.items():
+            start = writes.get(key)
+            if start is None:
+                self.debug("%s has no resource for %s, skipped",
+                           did, key, did=did)
+                continue
+            if key == 'switch' and device['mi_spec']:
+                val = bool(val)
+            params.append(start + json.dumps(val, separators=(',', ':')))
+        if not params:
+            return None
+
+        if device['mi_spec']:
+            head = '{{"cmd":"write","did":{},"id":{},"mi_spec":['.format(
+                json.dumps(did), msg_id)
+        else:
+            head = '{{"cmd":"write","did":{},"id":{},"params":['.format(
+                json.dumps(did), msg_id)
+        return (head + '},'.join(params) + '}]}').encode()
+
+    def _queue_write(self, device: dict, did: str, data: dict,
+                     priority: int, waiter: asyncio.Future = None,
+                     retries: int = 0):
+        """ pass the write to the coalescer or to the loop """
+        if self._outbound:
+            self._outbound.add(device, did, data, priority, waiter, retries)
+        else:
+            call_in_loop(
+                self.hass.loop, self._publish_write, device, did, dict(data),
+                priority, [waiter] if waiter else [], retries)
+
+    def _publish_write(self, device: dict, did: str, data: dict,
+                       priority: int, waiters: list, retries: int):
+        """ publish the write of the attrs and wait for the response """
+        msg_id = self.pending_writes.next_id()
+        payload = self._encode_write(device, did, data, msg_id)
+        if payload is None:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(False)
+            return
+        self.pending_writes.add(
+            msg_id, device, did, 'zigbee/recv', payload, priority, retries,
+            waiters)
+        self._publish('zigbee/recv', payload, priority,
+                      partial(self.pending_writes.published, msg_id))
+
+    def _publish(self, topic: str, payload: bytes, priority: int,
+                 on_publish: Callable[[bool], None] = None):
+        """ publish through the rate limited queue if it is enabled """
+        if self.outbound_queue:
+            self.outbound_queue.put(topic, payload, priority, on_publish)
+        else:
+            self._mqttc.publish(topic, payload)
+            if on_publish:
+                on_publish(True)
+
+    async def async_send(self, device: dict, data: dict,
+                         priority: int = PRIORITY_INTERACTIVE,
+                         retries: int = 0) -> bool:
+        """Send the write and wait for the response of the device.
+
+        Return True if the device wrote all of the attrs, False on an error
+        or without a response. Idempotent writes may be retried.
+        """
+        if device['type'] != 'zigbee' and 'paring' not in data:
+            return self.send(device, data, priority)
+        data = dict(data)
+        did = data.pop('did', device['did'])
+        waiter = self.hass.loop.create_future()
+        self._queue_write(device, did, data, priority, waiter, retries)
+        return await waiter
+
+    def send(self, device: dict, data: dict,
+             priority: int = PRIORITY_INTERACTIVE):
+        """ send command, the background ones wait for the interactive """
         try:
             payload = {}
             if device['type'] == 'zigbee' or 'paring' in data:
                 did = data.get('did', device['did'])
                 data.pop('did', '')
-                params = []
-
-                # convert hass prop to lumi prop
-                if device['mi_spec']:
-                    payload = {'cmd': 'write', 'did': did, 'id': 5}
-                    for key, val in data.items():
-                        if key == 'switch':
-                            val = bool(val)
-                        key = next(
-                            p[0] for p in device['mi_spec'] if p[2] == key)
-                        params.append({
-                            'siid': int(key[0]), 'piid': int(key[2]), 'value': val
-                        })
-
-                    payload['mi_spec'] = params
-                else:
-                    params = [{
-                        'res_name': next(
-                            p[0] for p in device['params'] if p[2] == key),
-                        'value': val
-                    } for key, val in data.items()]
-
-                    payload = {
-                        'cmd': 'write',
-                        'did': did,
-                        'id': randint(0, 65535),
-                        'params': params,
-                    }
-
-                payload = json.dumps(payload, separators=(',', ':')).encode()
-                self._mqttc.publish('zigbee/recv', payload)
+                self._queue_write(device, did, data, priority)
             elif device['type'] == 'gateway':
                 if ATTR_HS_COLOR in data:
                     hs_color = data.get(ATTR_HS_COLOR, 0)
@@ -948,49 +1270,41 @@ class Gateway:
                         'id': randint(0, 65535)
                     }
                 payload = json.dumps(payload, separators=(',', ':')).encode()
-                self._mqttc.publish('ioctl/recv', payload)
+                self._publish('ioctl/recv', payload, priority)
             return True
         except ConnectionError:
             return False
 
 
-def prepare_aqaragateway(shell, model):
+async def prepare_aqaragateway(shell, model):
     """ Prepare supported Aqara Gateway """
+    setprop = "asetprop" if model in SIGMASTAR_MODELS else "setprop"
+    commands = []
     if model in SIGMASTAR_MODELS:
-        command = "chattr -i /data/scripts"
-        shell.run_command(command)
-    if model in SIGMASTAR_MODELS:
-        command = "asetprop persist.app.tty_enable true"
-    else:
-        command = "setprop persist.app.tty_enable true"
-    shell.write(command.encode() + b"\n")
-    if model in SIGMASTAR_MODELS:
-        command = "asetprop persist.app.debug_log true"
-    else:
-        command = "setprop persist.app.debug_log true"
-    shell.write(command.encode() + b"\n")
-    command = "mkdir -p /data/scripts"
-    shell.write(command.encode() + b"\n")
-    command = "echo -e '#!/bin/sh\r\n\r\nfw_manager.sh -r\r\n" \
-        "fw_manager.sh -t -k' > /data/scripts/post_init.sh"
-    shell.run_command(command)
-    command = "chmod a+x /data/scripts/post_init.sh"
-    shell.run_command(command)
-    command = "mkdir -p /data/bin"
-    shell.write(command.encode() + b"\n")
+        commands.append("chattr -i /data/scripts")
+    commands += [
+        "{} persist.app.tty_enable true".format(setprop),
+        "{} persist.app.debug_log true".format(setprop),
+        "mkdir -p /data/scripts",
+        "echo -e '#!/bin/sh\\n\\nfw_manager.sh -r\\n"
+        "fw_manager.sh -t -k' > /data/scripts/post_init.sh",
+        "chmod a+x /data/scripts/post_init.sh",
+        "mkdir -p /data/bin",
+    ]
+    await shell.run_commands(commands)
+
     if model in ('lumi.camera.agl001'):
-        shell.check_bin('mosquitto', MD5_MOSQUITTO_G2HPRO_ARMV7L , 'bin/armv7l/mosquitto_g2hpro')
-        command = "chattr +i /data/scripts"
-        shell.run_command(command)
+        await shell.check_bin('mosquitto', MD5_MOSQUITTO_G2HPRO_ARMV7L , 'bin/armv7l/mosquitto_g2hpro')
     elif model in SIGMASTAR_MODELS:
-        shell.check_bin('mosquitto', MD5_MOSQUITTO_NEW_ARMV7L , 'bin/armv7l/mosquitto_new')
-        command = "chattr +i /data/scripts"
-        shell.run_command(command)
+        await shell.check_bin('mosquitto', MD5_MOSQUITTO_NEW_ARMV7L , 'bin/armv7l/mosquitto_new')
     elif model in REALTEK_MODELS:
-        shell.check_bin('mosquitto', MD5_MOSQUITTO_MIPSEL, 'bin/mipsel/mosquitto')
+        await shell.check_bin('mosquitto', MD5_MOSQUITTO_MIPSEL, 'bin/mipsel/mosquitto')
+    # the scripts are locked after the binaries are in place
+    if model in ('lumi.camera.agl001') or model in SIGMASTAR_MODELS:
+        await shell.run_command("chattr +i /data/scripts")
 
 
-def is_aqaragateway(host: str,
+async def is_aqaragateway(host: str,
                     password: str,
                     device_name: str,
                     patched_fw: bool) -> Optional[dict]:
@@ -1005,13 +1319,13 @@ def is_aqaragateway(host: str,
             socket.inet_aton(host)
             if device_name and 'g2h' in device_name:
                 shell = TelnetShellG2H(host, password)
-                shell.login()
-                raw = str(shell.read_file('/etc/build.prop'))
+                await shell.login()
+                raw = str(await shell.read_file('/etc/build.prop'))
                 data = re.search(r"ro\.sys\.name=([a-zA-Z0-9.-]+).+", raw)
                 name = data.group(1) if data else ''
                 data = re.search(r"ro\.sys\.model=([a-zA-Z0-9.-]+).+", raw)
                 model = data.group(1) if data else ''
-                raw = str(shell.read_file('/mnt/config/miio/device.conf'))
+                raw = str(await shell.read_file('/mnt/config/miio/device.conf'))
                 data = re.search(r"mac=([a-zA-Z0-9:]+).+", raw)
                 mac = data.group(1) if data else ''
             elif device_name:
@@ -1027,19 +1341,17 @@ def is_aqaragateway(host: str,
                     shell = TelnetShellM2POE(host, password)
                 else:
                     shell = TelnetShell(host, password)
-                shell.login()
-                prop_raw = shell.get_prop("")
+                await shell.login()
+                props = await shell.get_props((
+                    'ro.sys.model', 'persist.sys.model', 'ro.sys.name',
+                    'persist.sys.miio_mac'))
                 if 'g2h pro' in device_name:
-                    data = re.search(r"\[ro\.sys\.model\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                    model = data.group(1) if data else shell.get_prop("ro.sys.model")
+                    model = props['ro.sys.model']
                 else:
-                    data = re.search(r"\[persist\.sys\.model\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                    model = data.group(1) if data else shell.get_prop("persist.sys.model")
-                data = re.search(r"\[ro\.sys\.name\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                name = data.group(1) if data else shell.get_prop("ro.sys.name")
-                data = re.search(r"\[persist\.sys\.miio_mac\]: \[([a-zA-Z0-9.-]+)\]", prop_raw)
-                mac = data.group(1) if data else shell.get_prop("persist.sys.miio_mac")
-                token = shell.get_token()
+                    model = props['persist.sys.model']
+                name = props['ro.sys.name']
+                mac = props['persist.sys.miio_mac']
+                token = await shell.get_token()
             else:
                 return result
 
@@ -1054,7 +1366,7 @@ def is_aqaragateway(host: str,
             result['status'] = 'ok'
             result['token'] = token
             if model in SUPPORTED_MODELS and not patched_fw:
-                prepare_aqaragateway(shell, model)
+                await prepare_aqaragateway(shell, model)
         if shell:
             shell.close()
 
@@ -0,0 +1,267 @@
+""" MQTT client on asyncio streams """
+import asyncio
+import logging
+import random
+import struct
+import time
+from typing import List, Optional, Tuple, Union
+
+MQTT_PORT = 1883
+KEEPALIVE = 60
+
+# packet types of MQTT 3.1.1, the high nibble of the fixed header
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x82  # with the reserved flags
+UNSUBSCRIBE = 0xA2
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MQTTMessage:
+    """ received message, the fields used of paho MQTTMessage """
+    __slots__ = ('topic', 'payload', 'qos', 'retain')
+
+    def __init__(self, topic: str, payload: bytes, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+def _string(value: Union[str, bytes]) -> bytes:
+    """ UTF-8 string with the length prefix """
+    if isinstance(value, str):
+        value = value.encode()
+    return struct.pack("!H", len(value)) + value
+
+
+def _packet(header: int, body: bytes) -> bytes:
+    """ fixed header with the remaining length and the body """
+    length = len(body)
+    data = bytearray([header])
+    while True:
+        byte, length = length % 128, length // 128
+        data.append(byte | 0x80 if length else byte)
+        if not length:
+            break
+    return bytes(data) + body
+
+
+class AsyncClient:
+    """MQTT 3.1.1 client driven by the event loop, no network thread.
+
+    It has the parts of the paho Client used by the gateway: the on_connect,
+    on_disconnect and on_message callbacks with the same arguments, loop_start,
+    loop_stop, subscribe, unsubscribe and publish. Only QoS 0 is sent, a QoS 1
+    message of the broker is acknowledged.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, loop: asyncio.AbstractEventLoop,
+                 keepalive: int = KEEPALIVE):
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self._loop = loop
+        self._keepalive = keepalive
+        self._client_id = "aqara-{:08x}".format(random.getrandbits(32))
+        self._host = None
+        self._port = MQTT_PORT
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tasks: List[asyncio.Task] = []
+        self._packet_id = 0
+        self._last_received = 0.0
+
+    @property
+    def connected(self) -> bool:
+        """ return True if the connection is opened """
+        return self._writer is not None
+
+    async def async_connect(self, host: str, port: int = MQTT_PORT,
+                            timeout: float = 5) -> int:
+        """Connect to the broker, return the code of CONNACK, 0 is accepted.
+
+        OSError is raised if the broker is not reachable, like paho.
+        """
+        self._host, self._port = host, port
+        self._close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout=timeout)
+        writer.write(_packet(CONNECT, b"".join([
+            _string("MQTT"),
+            bytes([4, 0x02]),  # level 3.1.1, clean session
+            struct.pack("!H", self._keepalive),
+            _string(self._client_id),
+        ])))
+        try:
+            header, body = await asyncio.wait_for(
+                self._read_packet(reader), timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError) as err:
+            writer.close()
+            raise ConnectionError("no CONNACK from {}".format(host)) from err
+        if header & 0xF0 != CONNACK or len(body) < 2:
+            writer.close()
+            raise ConnectionError("unexpected packet from {}".format(host))
+        ret = body[1]
+        if ret != 0:
+            writer.close()
+            return ret
+
+        self._reader, self._writer = reader, writer
+        self._last_received = time.monotonic()
+        if self.on_connect:
+            self.on_connect(self, None, {'session present': body[0] & 1}, ret)
+        return ret
+
+    async def async_reconnect(self) -> int:
+        """ connect again to the last broker """
+        if self._host is None:
+            raise ConnectionError("connect was not called")
+        return await self.async_connect(self._host, self._port)
+
+    def loop_start(self):
+        """ start to read the messages and to keep the connection alive """
+        if self._tasks or not self.connected:
+            return
+        self._tasks = [
+            self._loop.create_task(self._read_loop()),
+            self._loop.create_task(self._keepalive_loop()),
+        ]
+
+    def loop_stop(self):
+        """ stop the tasks and close the connection without on_disconnect """
+        self._close()
+
+    def disconnect(self):
+        """ send DISCONNECT and close the connection """
+        self._write(_packet(DISCONNECT, b""))
+        self._close()
+
+    def subscribe(self, topic: Union[str, List[Tuple[str, int]]], qos=0):
+        """ subscribe one topic or a list of (topic, qos) """
+        topics = [(topic, qos)] if isinstance(topic, str) else topic
+        body = struct.pack("!H", self._next_packet_id()) + b"".join(
+            _string(name) + bytes([min(topic_qos, 1)])
+            for name, topic_qos in topics)
+        self._send(_packet(SUBSCRIBE, body))
+
+    def unsubscribe(self, topic: Union[str, List[str]]):
+        """ unsubscribe one topic or a list """
+        topics = [topic] if isinstance(topic, str) else topic
+        body = struct.pack("!H", self._next_packet_id()) + b"".join(
+            _string(name) for name in topics)
+        self._send(_packet(UNSUBSCRIBE, body))
+
+    def publish(self, topic: str, payload: Union[str, bytes] = b"",
+                qos=0, retain=False):
+        """Publish with QoS 0, it may be called from any thread."""
+        # pylint: disable=unused-argument
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._send(_packet(PUBLISH | int(retain), _string(topic) + payload))
+
+    def _next_packet_id(self) -> int:
+        self._packet_id = self._packet_id % 0xFFFF + 1
+        return self._packet_id
+
+    def _send(self, data: bytes):
+        """ write from the loop, other threads hand over to the loop """
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._write(data)
+        else:
+            self._loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data: bytes):
+        if self._writer is None:
+            _LOGGER.debug(f"{self._host}: MQTT is not connected, drop packet")
+            return
+        self._writer.write(data)
+
+    def _close(self):
+        current = asyncio.current_task(self._loop) \
+            if self._loop.is_running() else None
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        self._tasks = []
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    @staticmethod
+    async def _read_packet(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+        header = (await reader.readexactly(1))[0]
+        length, shift = 0, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        return header, await reader.readexactly(length) if length else b""
+
+    async def _read_loop(self):
+        # pylint: disable=broad-except
+        reader = self._reader
+        try:
+            while True:
+                header, body = await self._read_packet(reader)
+                self._last_received = time.monotonic()
+                if header & 0xF0 != PUBLISH:
+                    continue
+                try:
+                    self._handle_publish(header, body)
+                except (ValueError, struct.error) as err:
+                    # a bad topic or body, the next packets are still good
+                    _LOGGER.debug(
+                        f"{self._host}: skip malformed MQTT message: {err!r}")
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as err:
+            _LOGGER.debug(f"{self._host}: MQTT connection lost: {err!r}")
+        except Exception as err:
+            # any other end of the reads goes through on_disconnect too, a
+            # cancel of loop_stop is not caught
+            _LOGGER.warning(f"{self._host}: MQTT read failed: {err!r}")
+        self._lost()
+
+    def _handle_publish(self, header: int, body: bytes):
+        qos = (header >> 1) & 0x03
+        length = struct.unpack_from("!H", body)[0]
+        pos = 2 + length
+        if len(body) < pos + (2 if qos else 0):
+            raise ValueError("PUBLISH shorter than its topic")
+        topic = body[2:pos].decode()
+        if qos:
+            packet_id = body[pos:pos + 2]
+            pos += 2
+            if qos == 1:
+                self._write(_packet(PUBACK, packet_id))
+        if self.on_message:
+            self.on_message(self, None, MQTTMessage(
+                topic, body[pos:], qos, bool(header & 0x01)))
+
+    async def _keepalive_loop(self):
+        interval = self._keepalive / 2
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self._last_received > self._keepalive * 1.5:
+                _LOGGER.debug(f"{self._host}: MQTT keepalive timeout")
+                self._lost()
+                return
+            self._write(_packet(PINGREQ, b""))
+
+    def _lost(self):
+        """ the connection is lost, close it and tell the owner """
+        self._close()
+        if self.on_disconnect:
+            self.on_disconnect(self, None, 1)
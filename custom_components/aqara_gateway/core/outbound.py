@@ -0,0 +1,340 @@
+""" Outbound stage of the writes to the devices """
+import asyncio
+import logging
+import random
+from collections import deque
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from .const import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def call_in_loop(loop: asyncio.AbstractEventLoop, func: Callable, *args):
+    """ call in place in the loop, other threads hand over to the loop """
+    try:
+        in_loop = asyncio.get_running_loop() is loop
+    except RuntimeError:
+        in_loop = False
+    if in_loop:
+        func(*args)
+    else:
+        loop.call_soon_threadsafe(func, *args)
+
+
+def _set_result(waiters: List[asyncio.Future], result: bool):
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_result(result)
+
+
+class WriteCoalescer:
+    """Merge the writes of a device made within the window into one.
+
+    The window starts with the first write of the device. A later value of
+    an attribute replaces the earlier one in its first position, so the
+    attributes are written in the order they were first set, e.g. power
+    before mode for {power} then {mode, power}. add may be called from any
+    thread, the handler is called in the event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, window: float,
+                 handler: Callable[[dict, str, dict, int, list, int], None]):
+        self._loop = loop
+        self.window = window
+        self._handler = handler
+        # did: [device, data, priority, waiters, retries]
+        self._pending: Dict[str, list] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self.merged = 0  # writes merged into an earlier one
+
+    def add(self, device: dict, did: str, data: dict,
+            priority: int = PRIORITY_INTERACTIVE,
+            waiter: Optional[asyncio.Future] = None, retries: int = 0):
+        """Queue the write of the attributes of the device, the waiter gets
+        the result of the merged write."""
+        call_in_loop(self._loop, self._add, device, did, dict(data),
+                      priority, waiter, retries)
+
+    def _add(self, device: dict, did: str, data: dict, priority: int,
+             waiter: Optional[asyncio.Future], retries: int):
+        waiters = [waiter] if waiter else []
+        if did not in self._pending:
+            self._pending[did] = [device, data, priority, waiters, retries]
+            self._timers[did] = self._loop.call_later(
+                self.window, self._flush, did)
+            return
+
+        self.merged += 1
+        pending = self._pending[did]
+        pending[1].update(data)
+        # the merged write goes with the most urgent priority, it is retried
+        # only if all of the writes may be
+        pending[2] = min(pending[2], priority)
+        pending[3].extend(waiters)
+        pending[4] = min(pending[4], retries)
+
+    def _flush(self, did: str):
+        self._timers.pop(did, None)
+        device, data, priority, waiters, retries = self._pending.pop(did)
+        self._handler(device, did, data, priority, waiters, retries)
+
+    def cancel(self):
+        """ cancel the timers, the pending writes are dropped """
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for pending in self._pending.values():
+            _set_result(pending[3], False)
+        self._pending.clear()
+
+
+class OutboundQueue:
+    """Publish the writes at a limited rate, the interactive ones first.
+
+    A token bucket of burst tokens refills at rate tokens a second and each
+    publish takes one, the writes without a token wait in the queue of
+    their priority. The backlog is bounded, a full queue drops the oldest
+    background write for a new interactive one, else the new write. The
+    on_publish callback of a write is called with True when it is
+    published, or with False when it is dropped.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, rate: float,
+                 burst: int, backlog: int,
+                 publish: Callable[[str, bytes], None]):
+        self._loop = loop
+        self.rate = rate
+        self.burst = burst
+        self.backlog = backlog
+        self._publish = publish
+        self._queues = {
+            PRIORITY_INTERACTIVE: deque(),
+            PRIORITY_BACKGROUND: deque(),
+        }
+        self._tokens = float(burst)
+        self._updated = loop.time()
+        self._timer = None
+        self.max_depth = 0
+        self.dropped = 0
+        self.sent = 0
+        self.wait_total = 0.0  # seconds in the queue of the sent writes
+        self.wait_max = 0.0
+
+    @property
+    def depth(self) -> int:
+        """ the writes waiting in the queue """
+        return sum(len(queue) for queue in self._queues.values())
+
+    def put(self, topic: str, payload: bytes,
+            priority: int = PRIORITY_INTERACTIVE,
+            on_publish: Optional[Callable[[bool], None]] = None):
+        """ queue the publish, it may be called from any thread """
+        call_in_loop(self._loop, self._put, topic, payload, priority,
+                     on_publish)
+
+    def _put(self, topic: str, payload: bytes, priority: int,
+             on_publish: Optional[Callable[[bool], None]]):
+        if self.depth >= self.backlog:
+            background = self._queues[PRIORITY_BACKGROUND]
+            self.dropped += 1
+            if priority == PRIORITY_BACKGROUND or not background:
+                _LOGGER.debug(f"Outbound queue is full, drop {topic} write")
+                if on_publish:
+                    on_publish(False)
+                return
+            dropped = background.popleft()[3]
+            if dropped:
+                dropped(False)
+
+        self._queues[priority].append(
+            (self._loop.time(), topic, payload, on_publish))
+        self.max_depth = max(self.max_depth, self.depth)
+        if self._timer is None:
+            self._drain()
+
+    def _drain(self):
+        self._timer = None
+        now = self._loop.time()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            while queue and self._tokens >= 1:
+                queued, topic, payload, on_publish = queue.popleft()
+                self._tokens -= 1
+                self.sent += 1
+                self.wait_total += now - queued
+                self.wait_max = max(self.wait_max, now - queued)
+                self._publish(topic, payload)
+                if on_publish:
+                    on_publish(True)
+
+        if self.depth:
+            self._timer = self._loop.call_later(
+                (1 - self._tokens) / self.rate, self._drain)
+
+    @property
+    def wait_avg(self) -> float:
+        """ average seconds in the queue of the sent writes """
+        return self.wait_total / self.sent if self.sent else 0.0
+
+    def cancel(self):
+        """ cancel the timer, the queued writes are dropped """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        for queue in self._queues.values():
+            queue.clear()
+
+
+# upper bounds in seconds of the latency buckets, the last one is unbounded
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class PendingWrites:
+    """Writes waiting for the response of the device, keyed by message id.
+
+    The timeout and the latency start when the write is really published,
+    not while it waits in the outbound queue. write_ack of the gateway marks
+    a write as accepted, write_rsp of the device completes it and its
+    latency is counted in the histograms of the did and of the model. A
+    write without a response within the timeout is published again while it
+    has retries left, else it fails. A write dropped by the queue fails.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, timeout: float,
+                 publish: Callable[[str, bytes, int, Callable], None]):
+        self._loop = loop
+        self.timeout = timeout
+        self._publish = publish
+        # random start, the ids of the app or the cloud on the same broker
+        # are less likely to match the ids of a restarted gateway
+        self._last_id = random.randrange(0xFFFF)
+        # msg id: [did, model, topic, payload, priority, retries, waiters,
+        #          time of the first publish, timer], no timer while queued
+        self._pending: Dict[int, list] = {}
+        self.latency: Dict[str, List[int]] = {}  # did or model: counts
+        self.confirmed = 0
+        self.failed = 0  # write_rsp with an error code
+        self.dropped = 0  # dropped by the outbound queue
+        self.acked = 0
+        self.timeouts = 0
+        self.retried = 0
+
+    def next_id(self) -> int:
+        """ sequential message id, 1 to 65535 """
+        self._last_id = self._last_id % 0xFFFF + 1
+        return self._last_id
+
+    def add(self, msg_id: int, device: dict, did: str, topic: str,
+            payload: bytes, priority: int, retries: int = 0,
+            waiters: Optional[List[asyncio.Future]] = None):
+        """Wait for the response of the write, call published when the
+        write leaves the outbound queue."""
+        self._pending[msg_id] = [
+            did, device.get('model'), topic, payload, priority, retries,
+            waiters or [], None, None,
+        ]
+
+    def published(self, msg_id: int, sent: bool):
+        """ start the timeout of the published write, fail a dropped one """
+        entry = self._pending.get(msg_id)
+        if entry is None:
+            # answered or cancelled while it was queued
+            return
+        if not sent:
+            del self._pending[msg_id]
+            self.dropped += 1
+            _set_result(entry[6], False)
+            return
+        if entry[7] is None:
+            entry[7] = self._loop.time()
+        entry[8] = self._loop.call_later(self.timeout, self._timeout, msg_id)
+
+    def _get(self, msg_id: int, did: Optional[str]) -> Optional[list]:
+        """ the pending write of the id, None if it is of another did """
+        entry = self._pending.get(msg_id)
+        if entry is None or (did is not None and entry[0] != did):
+            return None
+        return entry
+
+    def ack(self, msg_id: int, did: Optional[str] = None):
+        """ the gateway accepted the write """
+        if self._get(msg_id, did) is not None:
+            self.acked += 1
+
+    def resolve(self, msg_id: int, success: bool,
+                did: Optional[str] = None) -> bool:
+        """The device answered the write, False for an unknown id or a
+        response of another did."""
+        entry = self._get(msg_id, did)
+        if entry is None:
+            return False
+        del self._pending[msg_id]
+        did, model, *_, waiters, start, timer = entry
+        if timer:
+            timer.cancel()
+        if success:
+            self.confirmed += 1
+        else:
+            self.failed += 1
+        if start is not None:
+            latency = self._loop.time() - start
+            for key in (did, model):
+                self._count(key, latency)
+        _set_result(waiters, success)
+        return True
+
+    def _count(self, key: str, latency: float):
+        counts = self.latency.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 1))
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                counts[i] += 1
+                return
+        counts[-1] += 1
+
+    def percentile(self, key: str, part: float) -> Optional[float]:
+        """ upper bound of the bucket with the part of the latencies """
+        counts = self.latency.get(key)
+        if not counts:
+            return None
+        target = part * sum(counts)
+        total = 0
+        for i, count in enumerate(counts):
+            total += count
+            if total >= target:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) \
+                    else float('inf')
+        return None
+
+    def _timeout(self, msg_id: int):
+        entry = self._pending[msg_id]
+        if entry[5] > 0:
+            entry[5] -= 1
+            self.retried += 1
+            _LOGGER.debug(f"{entry[0]}: no response to write {msg_id}, retry")
+            # the timeout starts again when the retry is published, so the
+            # write is never in the queue twice
+            entry[8] = None
+            self._publish(entry[2], entry[3], entry[4],
+                          partial(self.published, msg_id))
+            return
+
+        del self._pending[msg_id]
+        self.timeouts += 1
+        _LOGGER.debug(f"{entry[0]}: no response to write {msg_id}")
+        _set_result(entry[6], False)
+
+    def cancel(self):
+        """ cancel the timers, the waiters get False """
+        for entry in self._pending.values():
+            if entry[8]:
+                entry[8].cancel()
+            _set_result(entry[6], False)
+        self._pending.clear()
@@ -0,0 +1,137 @@
+""" Recorder of the MQTT traffic of a gateway """
+import asyncio
+import logging
+import os
+import struct
+import time
+from typing import Iterator, List, Optional, Tuple
+
+# file header, then one frame per message: the header below, the topic and
+# the raw payload
+MAGIC = b"AQMQ\x01"
+FRAME = struct.Struct("!dHI")  # unix time, topic length, payload length
+
+# messages kept in memory while the disk is slow, the newer ones are dropped
+MAX_BUFFER = 8 * 1024 * 1024
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, str, bytes]]:
+    """ return the (time, topic, payload) of the messages of a capture """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture")
+        while True:
+            header = file.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            created, topic_len, payload_len = FRAME.unpack(header)
+            topic = file.read(topic_len)
+            payload = file.read(payload_len)
+            if len(payload) < payload_len:
+                # the last frame of a capture which was not closed
+                return
+            yield created, topic.decode(), payload
+
+
+class Recorder:
+    """Append the received messages to a capture file, rotated by size.
+
+    The frames are collected in the event loop and written by the executor
+    at most once a second, one write at a time so they keep their order.
+    The full file is renamed to .1 and the older ones move up to backups.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, hass, path: str, max_size: int, backups: int = 5,
+                 interval: float = 1.0):
+        self.hass = hass
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+        self.interval = interval
+        self._buffer: List[bytes] = []
+        self._buffer_size = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writing: Optional[asyncio.Future] = None
+        self._file = None
+        self.frames = 0
+        self.dropped = 0
+
+    def record(self, topic: str, payload: bytes):
+        """ queue the message, called in the event loop """
+        if self._buffer_size >= MAX_BUFFER:
+            self.dropped += 1
+            return
+        topic = topic.encode()
+        frame = FRAME.pack(time.time(), len(topic), len(payload)) + topic + \
+            payload
+        self._buffer.append(frame)
+        self._buffer_size += len(frame)
+        self.frames += 1
+        if self._timer is None:
+            self._timer = self.hass.loop.call_later(
+                self.interval, self._flush)
+
+    def _flush(self):
+        self._timer = None
+        if not self._buffer:
+            return
+        if self._writing is not None and not self._writing.done():
+            # the previous write is still running, try again later
+            self._timer = self.hass.loop.call_later(
+                self.interval, self._flush)
+            return
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        self._buffer_size = 0
+        self._writing = self.hass.async_add_executor_job(self._write, data)
+
+    def _write(self, data: bytes):
+        """ write the frames, runs in the executor """
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, 'ab')
+                if self._file.tell() == 0:
+                    self._file.write(MAGIC)
+            self._file.write(data)
+            self._file.flush()
+            if self._file.tell() >= self.max_size:
+                self._rotate()
+        except OSError as err:
+            _LOGGER.warning(f"Can't write the capture {self.path}: {err}")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _close(self, data: bytes):
+        if data:
+            self._write(data)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """ write the queued frames and close the file """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        self._buffer_size = 0
+
+        def close_file(*_):
+            self.hass.async_add_executor_job(self._close, data)
+
+        if self._writing is not None and not self._writing.done():
+            # after the running write, the file is not shared by threads
+            self._writing.add_done_callback(close_file)
+        else:
+            close_file()
@@ -1,10 +1,13 @@
 """ Telnet Shell """
 # pylint: disable=line-too-long
-import time
+import asyncio
 import base64
+import random
+import re
+import time
 
-from typing import Union
-from telnetlib import Telnet
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Union
 
 from .const import (
     SIGMASTAR_MODELS,
@@ -21,8 +24,31 @@ DOWNLOAD_SOCAT = "(wget -O /data/socat http://pkg.simple-ha.ru/mipsel/socat && c
 RUN_SOCAT_BT_IRDA = "/data/socat tcp-l:8888,reuseaddr,fork /dev/ttyS2"
 RUN_SOCAT_ZIGBEE = "/data/socat tcp-l:8888,reuseaddr,fork /dev/ttyS1"
 
+TELNET_PORT = 23
+# a shell used within this time is not health checked again
+SHELL_CHECK_INTERVAL = 30
+# the output of a lent shell is discarded until it is quiet this long
+SHELL_DRAIN_QUIET = 0.05
+
+# telnet commands, see telnetlib
+IAC = bytes([255])  # interpret as command
+DONT = bytes([254])
+DO = bytes([253])
+WONT = bytes([252])
+WILL = bytes([251])
+SB = bytes([250])  # subnegotiation begin
+SE = bytes([240])  # subnegotiation end
+
+# one "[key]: [value]" entry of the getprop dump, the lines may be joined
+PROP_ENTRY = re.compile(r"\[([^\[\]\r\n]+)\]: \[([^\[\]\r\n]*)\]")
+
+
+def parse_props(raw: str) -> Dict[str, str]:
+    """ parse the dump of getprop or agetprop to a dict in one pass """
+    return dict(PROP_ENTRY.findall(raw))
+
 
-class TelnetShell(Telnet):
+class TelnetShell:
     """ Telnet Shell """
     _aqara_property = False
     _suffix = "# "
@@ -30,114 +56,307 @@ class TelnetShell(Telnet):
 
     def __init__(self, host: str, password=""):
         """ init function """
-        super().__init__(host, timeout=5)
         self._host = host
         self._password = password
-
-    def login(self):
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._cookedq = b''  # data without telnet commands
+        self._rawq = b''  # incomplete telnet command
+        self._sb = False  # inside of a subnegotiation
+        self._eof = False  # the gateway closed the connection
+        self._timed_out = False  # a read ended without its match
+
+    @property
+    def connected(self) -> bool:
+        """ return True if the connection is opened """
+        return (self._writer is not None and not self._writer.is_closing()
+                and not self._eof)
+
+    @property
+    def timed_out(self) -> bool:
+        """ True if a read ended without its match since the last drain,
+        the rest of that output may still come """
+        return self._timed_out
+
+    async def connect(self):
+        """ open the connection """
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, TELNET_PORT), timeout=5)
+
+    def close(self):
+        """ close the connection """
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        self._cookedq = self._rawq = b''
+        self._sb = False
+        self._eof = self._timed_out = False
+
+    def write(self, buffer: bytes):
+        """ write to the connection, IAC is doubled like telnetlib """
+        if self._writer is None:
+            raise ConnectionError("Telnet connection is closed")
+        self._writer.write(buffer.replace(IAC, IAC + IAC))
+
+    def _process_rawq(self, data: bytes) -> bytes:
+        """ strip telnet commands and refuse every option like telnetlib """
+        buf = self._rawq + data
+        self._rawq = b''
+        cooked = bytearray()
+        i = 0
+        while i < len(buf):
+            if self._sb:
+                end = buf.find(IAC + SE, i)
+                if end < 0:
+                    self._rawq = IAC if buf.endswith(IAC) else b''
+                    break
+                self._sb = False
+                i = end + 2
+                continue
+            if buf[i] != IAC[0]:
+                cooked.append(buf[i])
+                i += 1
+                continue
+            cmd = buf[i + 1:i + 2]
+            if not cmd or (cmd in (DO, DONT, WILL, WONT) and i + 2 >= len(buf)):
+                self._rawq = buf[i:]
+                break
+            if cmd == IAC:
+                cooked.append(IAC[0])
+                i += 2
+            elif cmd in (DO, DONT):
+                self._writer.write(IAC + WONT + buf[i + 2:i + 3])
+                i += 3
+            elif cmd in (WILL, WONT):
+                self._writer.write(IAC + DONT + buf[i + 2:i + 3])
+                i += 3
+            else:
+                self._sb = cmd == SB
+                i += 2
+        return bytes(cooked)
+
+    async def read_until(self, match: bytes, timeout: float = 15) -> bytes:
+        """Read until the match or the timeout, like Telnet.read_until.
+
+        Telnet.read_until waits forever without a timeout, here the wait is
+        always bounded.
+        """
+        if self._reader is None:
+            raise ConnectionError("Telnet connection is closed")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while match not in self._cookedq:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                data = await asyncio.wait_for(
+                    self._reader.read(4096), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                self._eof = True
+                if not self._cookedq:
+                    raise EOFError("telnet connection closed")
+                break
+            self._cookedq += self._process_rawq(data)
+
+        i = self._cookedq.find(match)
+        if i >= 0:
+            i += len(match)
+            buf, self._cookedq = self._cookedq[:i], self._cookedq[i:]
+        else:
+            buf, self._cookedq = self._cookedq, b''
+            self._timed_out = True
+        return buf
+
+    async def drain(self, quiet: float = SHELL_DRAIN_QUIET,
+                    timeout: float = 1) -> bytes:
+        """ discard the unread output until the shell is quiet, return it """
+        if self._reader is None:
+            raise ConnectionError("Telnet connection is closed")
+        buf, self._cookedq = self._cookedq, b''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            try:
+                data = await asyncio.wait_for(
+                    self._reader.read(4096), timeout=quiet)
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                self._eof = True
+                break
+            buf += self._process_rawq(data)
+        self._timed_out = False
+        return buf
+
+    async def login(self):
         """ login function """
+        if not self.connected:
+            await self.connect()
+
         self.write(b"\n")
-        self.read_until(b"login: ", timeout=10)
+        await self.read_until(b"login: ", timeout=10)
 
-        self.run_command("admin")
+        await self.run_command("admin")
         if self._password:
-            self.read_until(b"Password: ", timeout=1)
+            await self.read_until(b"Password: ", timeout=1)
             self.write(self._password.encode() + b"\n")
-        self.run_command("stty -echo")
+        await self.run_command("stty -echo")
         self.write(b"\n")
-        self.read_until(b" # ", timeout=2)
+        await self.read_until(b" # ", timeout=2)
 
 #        self.run_command("export PS1='# '")
 
-    def run_command(self, command: str, as_bytes=False) -> Union[str, bytes]:
+    async def run_command(
+        self, command: str, as_bytes=False
+    ) -> Union[str, bytes]:
         """Run command and return it result."""
         # pylint: disable=broad-except
         try:
             self.write(command.encode() + b"\n")
             suffix = "\r\n{}".format(self._suffix)
-            raw = self.read_until(suffix.encode(), timeout=15)
+            raw = await self.read_until(suffix.encode(), timeout=15)
         except Exception:
             raw = b''
         return raw if as_bytes else raw.decode()
 
-    def check_bin(self, filename: str, md5: str, url=None) -> bool:
+    async def run_commands(self, commands: List[str]) -> List[str]:
+        """Run several commands in one round trip and return their results.
+
+        Each command is a simple command line framed by echo sentinels, the
+        sentinels are quoted apart in the typed line so the echo of the input
+        is never taken for the output.
+        """
+        # pylint: disable=broad-except
+        if not commands:
+            return []
+        token = "@@{:08x}".format(random.getrandbits(32))
+        lines = [
+            'echo "{0}"":{1}<"; {2}; echo "{0}"":{1}>"'.format(token, i, command)
+            for i, command in enumerate(commands)
+        ]
+        try:
+            self.write("\n".join(lines).encode() + b"\n")
+            last = "{}:{}>".format(token, len(commands) - 1)
+            raw = (await self.read_until(last.encode(), timeout=15)).decode()
+            await self.read_until(self._suffix.encode(), timeout=1)
+        except Exception:
+            raw = ''
+        results = []
+        for i in range(len(commands)):
+            begin = "{}:{}<".format(token, i)
+            start = raw.find(begin)
+            end = raw.find("{}:{}>".format(token, i), start)
+            if start < 0 or end < 0:
+                results.append('')
+                continue
+            results.append(raw[start + len(begin):end].strip("\r\n"))
+        return results
+
+    async def read_files(self, filenames: List[str]) -> List[str]:
+        """ read several files in one round trip, missing files are empty """
+        return await self.run_commands(
+            ["cat {} 2>/dev/null".format(filename) for filename in filenames])
+
+    async def is_alive(self) -> bool:
+        """ check the logged in shell still answers """
+        if not self.connected:
+            return False
+        return "alive" in await self.run_command("echo alive")
+
+    async def check_bin(self, filename: str, md5: str, url=None) -> bool:
         """Check binary md5 and download it if needed."""
         # used * for development purposes
         if url:
-            self.run_command(WGET.format(url, filename))
-            return self.check_bin(filename, md5)
-        elif md5 in self.run_command("md5sum /data/bin/{}".format(filename)):
+            raw = (await self.run_commands([
+                WGET.format(url, filename),
+                "md5sum /data/bin/{}".format(filename)]))[1]
+            return md5 in raw
+        elif md5 in await self.run_command(
+                "md5sum /data/bin/{}".format(filename)):
             return True
         else:
             return False
 
-    def run_basis_cli(self, command: str, as_bytes=False) -> Union[str, bytes]:
+    async def run_basis_cli(
+        self, command: str, as_bytes=False
+    ) -> Union[str, bytes]:
         """Run command and return it result."""
         command = "basis_cli " + command
         self.write(command.encode() + b"\n")
-        self.read_until(self._suffix.encode())
-        self.read_until(self._suffix.encode())
+        raw = await self.read_until(self._suffix.encode())
+        raw += await self.read_until(self._suffix.encode())
+        return raw if as_bytes else raw.decode()
 
-    def file_exist(self, filename: str) -> bool:
+    async def file_exist(self, filename: str) -> bool:
         """ check file exit """
-        raw = self.run_command("ls -al {}".format(filename))
+        raw = await self.run_command("ls -al {}".format(filename))
         if "No such" not in str(raw):
             return True
         return False
 
-    def run_public_mosquitto(self, model):
+    async def run_public_mosquitto(self, model):
         """ run mosquitto as public """
-        if not self.file_exist("/data/bin/mosquitto"):
-            command = "mkdir -p /data/bin"
-            self.write(command.encode() + b"\n")
-            if model in ('lumi.camera.agl001'):
-                self.check_bin('mosquitto', MD5_MOSQUITTO_G2HPRO_ARMV7L , 'bin/armv7l/mosquitto_g2hpro')
-            elif model in SIGMASTAR_MODELS:
-                self.check_bin('mosquitto', MD5_MOSQUITTO_NEW_ARMV7L , 'bin/armv7l/mosquitto_new')
-            else:
-                self.check_bin('mosquitto', MD5_MOSQUITTO_MIPSEL, 'bin/mipsel/mosquitto')
-        self.run_command("killall mosquitto")
-        self.run_command("sleep .1")
-        self.run_command("/data/bin/mosquitto -d")
-
-    def check_public_mosquitto(self) -> bool:
+        if model in ('lumi.camera.agl001'):
+            md5, url = MD5_MOSQUITTO_G2HPRO_ARMV7L, 'bin/armv7l/mosquitto_g2hpro'
+        elif model in SIGMASTAR_MODELS:
+            md5, url = MD5_MOSQUITTO_NEW_ARMV7L, 'bin/armv7l/mosquitto_new'
+        else:
+            md5, url = MD5_MOSQUITTO_MIPSEL, 'bin/mipsel/mosquitto'
+        raw = (await self.run_commands([
+            "mkdir -p /data/bin", "md5sum /data/bin/mosquitto"]))[1]
+        # a missing or a broken binary is downloaded again
+        if md5 not in raw:
+            await self.check_bin('mosquitto', md5, url)
+        await self.run_commands([
+            "killall mosquitto",
+            "sleep .1",
+            "/data/bin/mosquitto -d",
+        ])
+
+    async def check_public_mosquitto(self) -> bool:
         """ get processes list """
-        raw = self.run_command("mosquitto")
+        raw = await self.run_command("mosquitto")
         if 'Binding listener to interface ""' in raw:
             return True
         if 'Binding listener to interface ' not in raw:
             return True
         return False
 
-    def get_running_ps(self, ps=None) -> str:
+    async def get_running_ps(self, ps=None) -> str:
         """ get processes list """
         if isinstance(ps, str):
-            return self.run_command(f"ps | grep {ps}")
-        return self.run_command("ps")
+            return await self.run_command(f"ps | grep {ps}")
+        return await self.run_command("ps")
 
-    def read_file(self, filename: str, as_base64=False, with_newline=True):
+    async def read_file(
+        self, filename: str, as_base64=False, with_newline=True
+    ):
         """ read file content """
         # pylint: disable=broad-except
         try:
             if as_base64:
                 command = "cat {} | base64\n".format(filename)
                 self.write(command.encode())
-                raw = self.read_until(self._suffix.encode()).decode()
+                raw = (await self.read_until(self._suffix.encode())).decode()
                 if not with_newline:
-                    raw = self.read_until(self._suffix.encode()).decode()
+                    raw = (await self.read_until(
+                        self._suffix.encode())).decode()
                 return base64.b64decode(raw)
             command = "cat {}\n".format(filename)
             self.write(command.encode())
-            ret = self.read_until(self._suffix.encode()).decode()
+            ret = (await self.read_until(self._suffix.encode())).decode()
             if not with_newline:
-                ret = self.read_until(self._suffix.encode()).decode()
+                ret = (await self.read_until(self._suffix.encode())).decode()
             if ret.endswith(self._suffix):
                 ret = "".join(ret.rsplit(self._suffix, 1))
             return ret.strip("\n")
         except Exception:
             return ''
 
-    def get_prop(self, property_value: str):
+    async def get_prop(self, property_value: str):
         """ get property """
         # pylint: disable=broad-except
         try:
@@ -145,7 +364,7 @@ class TelnetShell(Telnet):
                 command = "agetprop {}\n\r".format(property_value)
             else:
                 command = "getprop {}\n\r".format(property_value)
-            ret = self.run_command(command)
+            ret = await self.run_command(command)
             if ret.endswith(self._suffix):
                 ret = "".join(ret.rsplit(self._suffix, 1))
             if ret.startswith(self._suffix):
@@ -154,40 +373,61 @@ class TelnetShell(Telnet):
         except Exception:
             return ''
 
-    def set_prop(self, property_value: str, value: str):
+    async def get_props(self, keys: Iterable[str] = ()) -> Dict[str, str]:
+        """ get all properties, keys missing in the dump are fetched
+        in the same round trip and default to empty string """
+        getprop = "agetprop" if self._aqara_property else "getprop"
+        keys = list(keys)
+        commands = [getprop]
+        if keys:
+            commands.append("for k in {}; do echo \"[$k]: [$({} $k)]\"; done".format(
+                " ".join(keys), getprop))
+        raw = await self.run_commands(commands)
+        props = parse_props(raw[0])
+        fetched = parse_props(raw[1]) if keys else {}
+        for key in keys:
+            if key not in props:
+                props[key] = fetched.get(key, '')
+        return props
+
+    async def set_prop(self, property_value: str, value: str):
         """ set property """
         if self._aqara_property:
             command = "asetprop {} {}\n".format(property_value, value)
         else:
             command = "setprop {} {}\n".format(property_value, value)
         self.write(command.encode() + b"\n")
-        self.read_until(self._suffix.encode())
-        self.read_until(self._suffix.encode())
+        await self.read_until(self._suffix.encode())
+        await self.read_until(self._suffix.encode())
 
-    def get_version(self):
+    async def get_version(self):
         """ get gateway version """
-        return self.get_prop("ro.sys.fw_ver")
+        return await self.get_prop("ro.sys.fw_ver")
 
-    def set_audio_volume(self, value):
+    async def set_audio_volume(self, value):
         """ set gateway audio volume """
         if value > 100:
             value = 100
         command = "-sys -v {}".format(value)
-        raw = self.run_basis_cli(command)
+        raw = await self.run_basis_cli(command)
         return raw[raw.find(">>>") + 4:]
 
-    def get_token(self):
+    async def get_token(self):
         """ get gateway token """
         filename = "/data/miio/device.token"
-        if self.file_exist(filename):
-            return self.read_file(filename).rstrip().encode().hex()
+        if await self.file_exist(filename):
+            return (await self.read_file(filename)).rstrip().encode().hex()
         return None
 
-    def get_model(self):
+    async def get_model(self):
+        """ get the short model from the login banner """
+        # pylint: disable=broad-except
         try:
+            if not self.connected:
+                await self.connect()
             self.write(b"\n")
             suffix = ":"
-            raw = self.read_until(suffix.encode(), timeout=15)
+            raw = await self.read_until(suffix.encode(), timeout=15)
         except Exception:
             raw = b''
         model = raw.decode()
@@ -210,12 +450,14 @@ class TelnetShell(Telnet):
 
 class TelnetShellG2H(TelnetShell):
 
-    def login(self):
+    async def login(self):
         """ login function """
+        if not self.connected:
+            await self.connect()
         self._aqara_property = True
 
         self.write(b"\n")
-        self.read_until(b"login: ", timeout=10)
+        await self.read_until(b"login: ", timeout=10)
 
         password = self._password
         if ((self._password is None) or
@@ -225,73 +467,149 @@ class TelnetShellG2H(TelnetShell):
 
         self.write(b"root\n\r")
         if password:
-            self.read_until(b"Password: ", timeout=3)
+            await self.read_until(b"Password: ", timeout=3)
             #self.write(password.encode() + b"\n")
-            self.run_command(password)
+            await self.run_command(password)
 
-        self.run_command("stty -echo")
-        self.read_until(self._suffix.encode(), timeout=10)
+        await self.run_command("stty -echo")
+        await self.read_until(self._suffix.encode(), timeout=10)
         self._suffix = "# "
 
 
 class TelnetShellE1(TelnetShell):
 
-    def login(self):
+    async def login(self):
         """ login function """
+        if not self.connected:
+            await self.connect()
         self._aqara_property = True
 
         self.write(b"\n")
-        self.read_until(b"login: ", timeout=10)
+        await self.read_until(b"login: ", timeout=10)
         self.write(b"root\n\r")
 
-        self.read_until(b"Password: ", timeout=10)
+        await self.read_until(b"Password: ", timeout=10)
         self.write(b"\n\r")
 
-        self.read_until(b"/ # ", timeout=10)
+        await self.read_until(b"/ # ", timeout=10)
         self._suffix = "/ # "
 
-        self.run_command("stty -echo")
-        self.read_until(self._suffix.encode(), timeout=10)
+        await self.run_command("stty -echo")
+        await self.read_until(self._suffix.encode(), timeout=10)
 
 
 class TelnetShellG3(TelnetShell):
     _suffix = "~ # "
 
-    def login(self):
+    async def login(self):
         """ login function """
+        if not self.connected:
+            await self.connect()
         self._aqara_property = True
 
         self.write(b"\n")
-        self.read_until(b"login: ", timeout=3)
+        await self.read_until(b"login: ", timeout=3)
 
         self.write(b"root\n\r")
         if self._password:
-            self.read_until(b"Password: ", timeout=3)
+            await self.read_until(b"Password: ", timeout=3)
             self.write(self._password.encode() + b"\n")
 
-        self.run_command("cd /")
+        await self.run_command("cd /")
         self._suffix = "/ # "
 
-        self.run_command("stty -echo")
-        self.read_until(self._suffix.encode(), timeout=10)
+        await self.run_command("stty -echo")
+        await self.read_until(self._suffix.encode(), timeout=10)
 
 
 class TelnetShellM2POE(TelnetShell):
     _suffix = "/ # "
 
-    def login(self):
+    async def login(self):
         """ login function """
+        if not self.connected:
+            await self.connect()
         self._aqara_property = True
 
         self.write(b"\n")
-        self.read_until(b"login: ", timeout=10)
+        await self.read_until(b"login: ", timeout=10)
 
         self.write(b"root\n\r")
         if self._password:
-            self.read_until(b"Password: ", timeout=3)
+            await self.read_until(b"Password: ", timeout=3)
             self.write(self._password.encode() + b"\n")
 
-        self.read_until(b"/ # ", timeout=10)
-        self.run_command("stty -echo")
-        self.read_until(self._suffix.encode(), timeout=10)
-
+        await self.read_until(b"/ # ", timeout=10)
+        await self.run_command("stty -echo")
+        await self.read_until(self._suffix.encode(), timeout=10)
+
+
+class ShellPool:
+    """ Keep one logged in shell of a gateway and lend it to the callers """
+
+    def __init__(self, factory: Callable[[], Awaitable[TelnetShell]]):
+        """ factory returns a new shell which is not logged in """
+        self._factory = factory
+        self._shell: Optional[TelnetShell] = None
+        self._lock = asyncio.Lock()
+        self._last_used = 0.0
+        self.logins = 0
+        self.reuses = 0
+        self.login_time = 0.0  # seconds spent on all logins
+
+    @property
+    def login_time_saved(self) -> float:
+        """ estimated seconds saved by reusing the logged in shell """
+        if not self.logins:
+            return 0.0
+        return self.reuses * self.login_time / self.logins
+
+    @asynccontextmanager
+    async def borrow(self):
+        """ lend the shell to one caller at a time, login if needed """
+        async with self._lock:
+            shell = await self._acquire()
+            try:
+                yield shell
+            except BaseException:
+                # the state of the session is unknown, login again next time
+                self.close()
+                raise
+            if shell.timed_out or not shell.connected:
+                # the late output of the read may be taken for the answer
+                # of the next caller
+                self.close()
+            self._last_used = time.monotonic()
+
+    async def _acquire(self) -> TelnetShell:
+        if self._shell is not None:
+            shell = self._shell
+            try:
+                # the prompts left by the last caller are not the next answer
+                await shell.drain()
+            except OSError:
+                pass  # not connected, the health check fails below
+            if (time.monotonic() - self._last_used < SHELL_CHECK_INTERVAL and
+                    shell.connected) or await shell.is_alive():
+                self.reuses += 1
+                return shell
+            self.close()
+
+        start = time.monotonic()
+        shell = await self._factory()
+        try:
+            await shell.login()
+            await shell.drain()
+        except BaseException:
+            shell.close()
+            raise
+        self.login_time += time.monotonic() - start
+        self.logins += 1
+        self._shell = shell
+        return shell
+
+    def close(self):
+        """ close the shell, the next borrow will login again """
+        if self._shell is not None:
+            self._shell.close()
+            self._shell = None
@@ -0,0 +1,89 @@
+""" Throttle of the fast reported attributes """
+import asyncio
+import time
+from typing import Callable, Dict, Iterable, Tuple
+
+# the attributes of plugs, relays and vibration sensors which are reported
+# many times a second
+THROTTLE_ATTRIBUTES = (
+    'power', 'load_power', 'consumption', 'voltage',
+    'vibrate_intensity', 'tilt_angle',
+)
+
+
+class Throttle:
+    """Hold the attributes of the reports to a minimum interval.
+
+    A value passes at once when the interval has passed since the last value
+    of the attribute, or when it changed by the delta in percent of the last
+    value. Otherwise the latest value is held and sent by a timer when the
+    interval ends, so the last reading is not lost.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float,
+                 delta: float, handler: Callable[[str, dict], None],
+                 attributes: Iterable[str] = THROTTLE_ATTRIBUTES):
+        self._loop = loop
+        self.interval = interval
+        self.delta = delta
+        self._handler = handler
+        self._attributes = frozenset(attributes)
+        # (did, attr): (monotonic time, value) of the last value passed
+        self._sent: Dict[Tuple[str, str], tuple] = {}
+        self._held: Dict[str, dict] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self.held_count = 0  # values replaced by a newer one while held
+
+    def process(self, did: str, payload: dict) -> dict:
+        """ remove the values which are held from the payload, return it """
+        attrs = self._attributes.intersection(payload)
+        if not attrs:
+            return payload
+        now = time.monotonic()
+        for attr in attrs:
+            value = payload[attr]
+            sent = self._sent.get((did, attr))
+            if (sent is None or now - sent[0] >= self.interval
+                    or self._changed(sent[1], value)):
+                self._sent[(did, attr)] = (now, value)
+                self._held.get(did, {}).pop(attr, None)
+                continue
+
+            del payload[attr]
+            held = self._held.setdefault(did, {})
+            if attr in held:
+                self.held_count += 1
+            held[attr] = value
+            if did not in self._timers:
+                self._timers[did] = self._loop.call_later(
+                    sent[0] + self.interval - now, self._flush, did)
+        return payload
+
+    def _changed(self, last, value) -> bool:
+        """ True if the value changed by the delta percent """
+        if self.delta <= 0:
+            return False
+        if not isinstance(value, (int, float)) or \
+                not isinstance(last, (int, float)):
+            return value != last
+        if last == 0:
+            return value != 0
+        return abs(value - last) * 100 >= self.delta * abs(last)
+
+    def _flush(self, did: str):
+        """ send the values held for the device """
+        self._timers.pop(did, None)
+        payload = self._held.pop(did, None)
+        if not payload:
+            return
+        now = time.monotonic()
+        for attr, value in payload.items():
+            self._sent[(did, attr)] = (now, value)
+        self._handler(did, payload)
+
+    def cancel(self):
+        """ cancel the timers, the held values are dropped """
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._held.clear()
@@ -1,8 +1,11 @@
 """ device info and utils """
 # pylint: disable=broad-except, too-many-lines
+import asyncio
+import json
 import logging
 import re
 import uuid
+from collections import deque
 from datetime import datetime
 from typing import Optional
 
@@ -14,7 +17,14 @@ from homeassistant.exceptions import PlatformNotReady
 from homeassistant.helpers.device_registry import DeviceRegistry
 from miio import Device, DeviceException
 
-from .const import AIOT_MODELS, SIGMASTAR_MODELS, NO_ALARM_MODE_MODELS, INFRARED_SUPPORTED_MODELS
+from .converters import get_converter, xiaomi_battery, xiaomi_voltage
+from .const import (
+    AIOT_MODELS,
+    SIGMASTAR_MODELS,
+    NO_ALARM_MODE_MODELS,
+    INFRARED_SUPPORTED_MODELS,
+    VRF_MODELS
+)
 
 SOFT_HACK_REALTEK = {"ssid": "\"\"", "pswd": "123123 ; passwd -d admin ; echo enable > /sys/class/tty/tty/enable; telnetd"}
 SOFT_HACK_SIGMASTAR = {"ssid": "\"\"", "pswd": "123123 ; passwd -d root ; /bin/riu_w 101e 53 3012 ; telnetd"}
@@ -1990,42 +2000,120 @@ CLUSTERS = {
 
 
 TITLE = "Aqara Gateway Debug"
-NOTIFY_TEXT = '<a href="%s?r=10" target="_blank">Open Log<a>'
+# records kept by the debug view, the older ones are dropped
+DEBUG_RECORDS = 20000
+NOTIFY_TEXT = ('<a href="%s?r=10" target="_blank">Open Log</a> | '
+               '<a href="%s?s=1" target="_blank">Live Log</a>')
 HTML = (f'<!DOCTYPE html><html><head><title>{TITLE}</title>'
         '<meta http-equiv="refresh" content="%s"></head>'
         '<body><pre>%s</pre></body></html>')
+# the live log page, the records come from the same url with s=events and
+# only the last lines are kept in the page
+STREAM_HTML = (
+    f'<!DOCTYPE html><html><head><title>{TITLE}</title></head>'
+    '<body><pre id="log"></pre><script>'
+    'const log = document.getElementById("log");'
+    'const params = new URLSearchParams(location.search);'
+    'params.delete("c");'
+    'params.set("s", "events");'
+    'const source = new EventSource("?" + params);'
+    'source.onmessage = (event) => {'
+    'const bottom = innerHeight + scrollY >= document.body.offsetHeight - 2;'
+    'log.append(event.data + "\\n");'
+    'while (log.childNodes.length > 5000) log.firstChild.remove();'
+    'if (bottom) scrollTo(0, document.body.scrollHeight);'
+    '};'
+    '</script></body></html>'
+)
+# records queued for a live log client, a slow client loses the newer ones
+STREAM_QUEUE_SIZE = 1000
+STREAM_KEEPALIVE = 15
 
 
 class Utils:
     """ gateway utils """
+    # (zigbee model, cloud) => device description, built on first use
+    _catalog: Optional[dict] = None
+    _features: dict = {}
+
+    @staticmethod
+    def _get_catalog() -> dict:
+        """ return the index of DEVICES and DEVICES_AIOT/DEVICES_MIOT """
+        if Utils._catalog is None:
+            catalog = {}
+            for cloud, cloud_devices in (
+                    ('aiot', DEVICES_AIOT), ('miot', DEVICES_MIOT)):
+                for device in DEVICES + cloud_devices:
+                    for zigbee_model, desc in device.items():
+                        # the first device block wins
+                        if (zigbee_model in ('params', 'mi_spec') or
+                                (zigbee_model, cloud) in catalog):
+                            continue
+                        catalog[(zigbee_model, cloud)] = {
+                            # 'model': zigbee_model,
+                            'device_manufacturer': desc[0],
+                            'device_name': desc[0] + ' ' + desc[1],
+                            'device_model': zigbee_model + ' ' + desc[2]
+                            if len(desc) > 2 else zigbee_model,
+                            'params': device.get('params', ''),
+                            'mi_spec': device.get('mi_spec', '')
+                        }
+            Utils._catalog = catalog
+        return Utils._catalog
+
     @staticmethod
     def get_device(zigbee_model: str, cloud: str) -> Optional[dict]:
-        """ get device """
-        # the model has an extra tail when added
-        if re.match(r'\.v(\d)', zigbee_model[-3:]):
-            zigbee_model = zigbee_model[:-3]
+        """ get device, the description is shared and must not be changed """
+        cloud = 'aiot' if cloud == 'aiot' else 'miot'
+        catalog = Utils._get_catalog()
+        key = (zigbee_model, cloud)
+        if key not in catalog:
+            # the model has an extra tail when added
+            if re.match(r'\.v(\d)', zigbee_model[-3:]):
+                zigbee_model = zigbee_model[:-3]
+            # remember the tailed and unknown models too
+            catalog[key] = catalog.get((zigbee_model, cloud))
+        return catalog[key]
 
-        devices = []
-        devices.extend(DEVICES)
-        if cloud and cloud == "aiot":
-            devices.extend(DEVICES_AIOT)
-        else:
-            devices.extend(DEVICES_MIOT)
+    @staticmethod
+    def get_resource_index(device: dict, cloud: str = 'aiot') -> dict:
+        """Return the map of lumi res name (or siid.piid) to the hass attr
+        and the converter of the value for the model and cloud."""
+        index = {}
+        for param in (device['params'] or device['mi_spec']):
+            # the first param wins, same as scanning the list
+            if param[0] is not None:
+                index.setdefault(param[0], param[2])
 
-        for device in devices:
-            if zigbee_model in device:
-                desc = device[zigbee_model]
-                return {
-                    # 'model': zigbee_model,
-                    'device_manufacturer': desc[0],
-                    'device_name': desc[0] + ' ' + desc[1],
-                    'device_model': zigbee_model + ' ' + desc[2]
-                    if len(desc) > 2 else zigbee_model,
-                    'params': device.get('params', ''),
-                    'mi_spec': device.get('mi_spec', '')
-                }
+        # VRF params reuse ids of GLOBAL_PROP (e.g. 4.10.85 is 'power_3',
+        # not 'channel_1_decoupled'), so the device params win for them
+        if device.get('model') in VRF_MODELS:
+            index = {**GLOBAL_PROP, **index}
+        else:
+            index = {**index, **GLOBAL_PROP}
+        model = device.get('model')
+        return {
+            res: (attr, get_converter(attr, model, cloud))
+            for res, attr in index.items()
+        }
 
-        return None
+    @staticmethod
+    def get_write_index(device: dict) -> dict:
+        """Return the map of hass attr to the encoded start of its write
+        param, the value and the closing brace are appended when sent."""
+        index = {}
+        for param in (device['mi_spec'] or device['params'] or []):
+            # the first param wins, same as scanning the list
+            if param[0] is None or param[2] in index:
+                continue
+            if device['mi_spec']:
+                siid, piid = param[0].split('.')[:2]
+                index[param[2]] = '{{"siid":{},"piid":{},"value":'.format(
+                    int(siid), int(piid))
+            else:
+                index[param[2]] = '{{"res_name":{},"value":'.format(
+                    json.dumps(param[0]))
+        return index
 
     @staticmethod
     def remove_device(hass: HomeAssistant, did: str):
@@ -2043,6 +2131,9 @@ class Utils:
     @staticmethod
     def get_feature_suppported(zigbee_model: str) -> Optional[bool]:
         """ return the switch switch power consumption"""
+        if zigbee_model in Utils._features:
+            return Utils._features[zigbee_model]
+
         feature = {
             'is_metric': False,
             'support_power_consumption': False,
@@ -2051,20 +2142,15 @@ class Utils:
             'support_load_power': False,
             }
 
-        devices = []
-        devices.extend(DEVICES)
-        devices.extend(DEVICES_AIOT)
-
-        for device in devices:
-            if zigbee_model in device:
-                params = device.get('params', '')
-                for param in params:
-                    if 'consumption' in param:
-                        feature['support_power_consumption'] = True
-                    if 'load_voltage' in param:
-                        feature['support_load_voltage'] = True
-                    if 'load_power' in param:
-                        feature['support_load_power'] = True
+        device = Utils._get_catalog().get((zigbee_model, 'aiot'))
+        if device:
+            for param in device['params']:
+                if 'consumption' in param:
+                    feature['support_power_consumption'] = True
+                if 'load_voltage' in param:
+                    feature['support_load_voltage'] = True
+                if 'load_power' in param:
+                    feature['support_load_power'] = True
         if zigbee_model in (
             'lumi.plug',
             'lumi.plug.mitw01',
@@ -2074,6 +2160,7 @@ class Utils:
             'lumi.ctrl_86plug.aq1'
         ):
             feature['support_in_use'] = True
+        Utils._features[zigbee_model] = feature
         return feature
 
     @staticmethod
@@ -2191,71 +2278,179 @@ class Utils:
     @staticmethod
     def fix_xiaomi_battery(value: int) -> int:
         """Convert battery voltage to battery percent."""
-        if value <= 100:
-            return value
-        if value <= 2700:
-            return 0
-        if value >= 3200:
-            return 100
-        return int((value - 2700) / 5)
+        return xiaomi_battery(value)
 
     @staticmethod
     def fix_xiaomi_voltage(value: int) -> float:
         """Convert voltage to battery percent."""
-        if value <= 1000:
-            return round(value * 1000.0, 2)
-        return value
+        return xiaomi_voltage(value)
 
 
 class AqaraGatewayDebug(logging.Handler, HomeAssistantView):
     # pylint: disable=abstract-method, arguments-differ
-    """ debug handler """
+    """Debug handler, keeps the last records in a ring buffer.
+
+    The view shows the records with the filters of the query: q regex, l
+    minimum level, h gateway host, d did, m module, t tail, p page from the
+    end with n records a page, c clears the buffer and r reloads the page.
+    """
     name = "gateway_debug"
     requires_auth = False
 
-    text = ''
-
-    def __init__(self, hass: HomeAssistant):
+    def __init__(self, hass: HomeAssistant,
+                 capacity: int = DEBUG_RECORDS):
         super().__init__()
+        # (created, levelno, levelname, module, host, did, message)
+        self.records = deque(maxlen=capacity)
+        self._loop = hass.loop
+        self._streams = set()  # queues of the live log clients
 
         # random url because without authorization!!!
         self.url = "/{}".format(uuid.uuid4())
 
         hass.http.register_view(self)
         persistent_notification.async_create(
-            hass, message=NOTIFY_TEXT % self.url, title=TITLE)
+            hass, message=NOTIFY_TEXT % (self.url, self.url), title=TITLE)
 
     def handle(self, rec: logging.LogRecord) -> None:
-        date_time = datetime.fromtimestamp(rec.created).strftime(
+        # the message is formatted now, the args may be changed later by
+        # the caller and are not kept alive by the buffer
+        try:
+            message = rec.getMessage()
+        except (TypeError, ValueError):
+            message = "{} {}".format(rec.msg, rec.args)
+        record = (
+            rec.created, rec.levelno, rec.levelname,
+            'main' if rec.module == '__init__' else rec.module,
+            getattr(rec, 'host', None), getattr(rec, 'did', None),
+            message
+        )
+        self.records.append(record)
+        if self._streams:
+            self._loop.call_soon_threadsafe(self._push, record)
+
+    def _push(self, record: tuple):
+        for queue in self._streams:
+            if queue.full():
+                continue
+            queue.put_nowait(record)
+
+    @staticmethod
+    def format_record(record: tuple) -> str:
+        """ line of the record """
+        created, _, levelname, module, _, _, msg = record
+        date_time = datetime.fromtimestamp(created).strftime(
             "%Y-%m-%d %H:%M:%S")
-        module = 'main' if rec.module == '__init__' else rec.module
-        self.text = "{} {}  {}  {}  {}\n".format(
-            self.text, date_time, rec.levelname, module, rec.msg)
+        return "{} {}  {}  {}".format(date_time, levelname, module, msg)
+
+    def matcher(self, level: Optional[str] = None,
+                host: Optional[str] = None, did: Optional[str] = None,
+                module: Optional[str] = None, query: Optional[str] = None):
+        """ return the function of a record to its line, None if filtered """
+        levelno = logging.getLevelName(level.upper()) if level else 0
+        if not isinstance(levelno, int):
+            levelno = 0
+        reg = re.compile(fr"({query})", re.IGNORECASE) if query else None
+
+        def match(record: tuple) -> Optional[str]:
+            if record[1] < levelno or (host and record[4] != host) or \
+                    (module and record[3] != module):
+                return None
+            line = self.format_record(record)
+            if did and record[5] != did and did not in line:
+                return None
+            if reg and not reg.search(line):
+                return None
+            return line
+
+        return match
+
+    def filter_records(self, **filters):
+        """ the lines of the records which match all given filters """
+        match = self.matcher(**filters)
+        for record in list(self.records):
+            line = match(record)
+            if line is not None:
+                yield line
+
+    @staticmethod
+    def page(lines, size: int, page: int = 0) -> list:
+        """The page of the lines counted from the end, 0 is the last. The
+        first page is short when the lines do not fill it."""
+        lines = list(lines)
+        end = len(lines) - size * page
+        return lines[max(0, end - size):max(0, end)]
 
     async def get(self, request: web.Request):
         """ for shortcut """
         try:
-            if 'c' in request.query:
-                self.text = ''
+            query = request.query
+            if 'c' in query:
+                self.records.clear()
 
-            if 'q' in request.query or 't' in request.query:
-                lines = self.text.split('\n')
+            filters = {
+                'level': query.get('l'), 'host': query.get('h'),
+                'did': query.get('d'), 'module': query.get('m'),
+                'query': query.get('q'),
+            }
+            if query.get('s') == 'events':
+                return await self._stream(
+                    request, filters, int(query.get('t', 100)))
+            if 's' in query:
+                return web.Response(text=STREAM_HTML,
+                                    content_type="text/html")
 
-                if 'q' in request.query:
-                    reg = re.compile(fr"({request.query['q']})", re.IGNORECASE)
-                    lines = [p for p in lines if reg.search(p)]
+            lines = self.filter_records(**filters)
 
-                if 't' in request.query:
-                    tail = int(request.query['t'])
-                    lines = lines[-tail:]
+            if 't' in query:
+                lines = self.page(lines, int(query['t']))
+            elif 'p' in query or 'n' in query:
+                lines = self.page(
+                    lines, int(query.get('n', 1000)), int(query.get('p', 0)))
 
-                body = '\n'.join(lines)
-            else:
-                body = self.text
+            body = '\n'.join(lines)
 
-            reload = request.query.get('r', '')
+            reload = query.get('r', '')
             return web.Response(text=HTML % (reload, body),
                                 content_type="text/html")
 
         except Exception:
             return web.Response(status=500)
+
+    async def _stream(self, request: web.Request, filters: dict,
+                      tail: int) -> web.StreamResponse:
+        """ send the tail and then the new records as server-sent events """
+        match = self.matcher(**filters)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+
+        queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+        self._streams.add(queue)
+        try:
+            lines = self.page(self.filter_records(**filters), tail)
+            while True:
+                if lines:
+                    await response.write(''.join(
+                        ''.join(f"data: {part}\n" for part in line.split('\n'))
+                        + '\n' for line in lines
+                    ).encode())
+                try:
+                    record = await asyncio.wait_for(
+                        queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # comment line, keeps the connection of a quiet log
+                    await response.write(b": keepalive\n\n")
+                    lines = []
+                    continue
+                lines = [match(record)]
+                while not queue.empty():
+                    lines.append(match(queue.get_nowait()))
+                lines = [line for line in lines if line is not None]
+        except ConnectionResetError:
+            pass
+        finally:
+            self._streams.discard(queue)
+        return response
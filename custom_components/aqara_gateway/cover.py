@@ -53,19 +53,19 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """Perform the setup for Xiaomi devices."""
     def setup(gateway: Gateway, device: dict, attr: str):
         if device['model'] == 'lumi.curtain.acn002':
-            async_add_entities([AqaraRollerShadeE1(gateway, device, attr)])
+            return [AqaraRollerShadeE1(gateway, device, attr)]
         elif device['model'] == 'lumi.curtain.acn011':
-            async_add_entities([AqaraVerticalBlindsController(gateway, device, attr)])
+            return [AqaraVerticalBlindsController(gateway, device, attr)]
         elif device['model'] == 'lumi.curtain.acn010':
-            async_add_entities([AqaraCurtainMotorC4(gateway, device, attr)])
+            return [AqaraCurtainMotorC4(gateway, device, attr)]
         else:
             if device.get('mi_spec') or device['model'] == 'lumi.airer.acn001':
-                async_add_entities([XiaomiCoverMIOT(gateway, device, attr)])
+                return [XiaomiCoverMIOT(gateway, device, attr)]
             else:
-                async_add_entities([XiaomiGenericCover(gateway, device, attr)])
+                return [XiaomiGenericCover(gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('cover', setup)
+    aqara_gateway.add_setup('cover', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -76,6 +76,9 @@ async def async_unload_entry(hass, entry):
 
 class XiaomiGenericCover(GatewayGenericDevice, CoverEntity, RestoreEntity):
     """Representation of a XiaomiGenericCover."""
+    _update_keys = (
+        BATTERY, CHIP_TEMPERATURE, FW_VER, 'back_version', LQI, POLARITY,
+        MOTOR_STROKE, CHARGING_STATUS, WORKING_TIME, POSITION, RUN_STATE)
 
     def __init__(self, gateway, device, atrr):
         """Initialize the XiaomiGenericCover."""
@@ -238,6 +241,7 @@ class AqaraRollerShadeE1(XiaomiGenericCover):
 
 
 class AqaraVerticalBlindsController(XiaomiGenericCover):
+    _update_keys = (*XiaomiGenericCover._update_keys, TILT_POSITION)
 
     _attr_supported_features: CoverEntityFeature = (
         CoverEntityFeature.OPEN
@@ -301,6 +305,9 @@ class AqaraVerticalBlindsController(XiaomiGenericCover):
 
 class AqaraCurtainMotorC4(XiaomiGenericCover):
     """Aqara curtain motor C4 (lumi.curtain.acn010)."""
+    _update_keys = (
+        RUN_STATE, 'ch0_position', 'ch0_run_state', 'ch1_position',
+        'ch1_run_state')
 
     def __init__(self, gateway, device, atrr):
         if atrr == 'motor':
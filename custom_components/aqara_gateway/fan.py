@@ -38,11 +38,9 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """ Perform the setup for Xiaomi/Aqara devices. """
     def setup(gateway: Gateway, device: dict, attr: str):
         feature = Utils.get_feature_suppported(device["model"])
-        async_add_entities([
-            GatewayFan(gateway, device, attr, feature)
-        ])
+        return [GatewayFan(gateway, device, attr, feature)]
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('fan', setup)
+    aqara_gateway.add_setup('fan', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -53,6 +51,8 @@ async def async_unload_entry(hass, entry):
 
 class GatewayFan(GatewayGenericDevice, FanEntity, RestoreEntity):
     """Representation of a Xiaomi/Aqara Fan."""
+    _update_keys = (
+        CHIP_TEMPERATURE, FW_VER, 'back_version', LQI, 'power', 'fan_mode')
     # pylint: disable=unused-argument, too-many-instance-attributes
     def __init__(
         self,
@@ -36,13 +36,13 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """Perform the setup for Xiaomi/Aqara devices."""
     def setup(gateway: Gateway, device: dict, attr: str):
         if device['type'] == 'zigbee':
-            async_add_entities([GatewayLight(gateway, device, attr)])
+            return [GatewayLight(gateway, device, attr)]
         elif (device['type'] == 'gateway' and
                 Utils.gateway_light_supported(device['model'])):
-            async_add_entities([GatewayLight(gateway, device, attr)])
+            return [GatewayLight(gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('light', setup)
+    aqara_gateway.add_setup('light', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -53,6 +53,9 @@ async def async_unload_entry(hass, entry):
 
 class GatewayLight(GatewayGenericDevice, LightEntity):
     """Representation of a Xiaomi/Aqara Light."""
+    _update_keys = (
+        CHIP_TEMPERATURE, HW_VER, FW_VER, 'back_version', LQI,
+        ATTR_BRIGHTNESS, ATTR_COLOR_TEMP, ATTR_RGB_COLOR, ATTR_HS_COLOR)
 
     _attr_min_color_temp_kelvin: int = 2702  # 370
     _attr_max_color_temp_kelvin: int = 6535  # 153
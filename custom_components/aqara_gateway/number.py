@@ -6,6 +6,7 @@ from homeassistant.components.number import (
 from homeassistant.const import EntityCategory, UnitOfTime
 
 from . import DOMAIN, GatewayGenericDevice
+from .core.const import PRIORITY_BACKGROUND
 from .core.gateway import Gateway
 
 
@@ -13,10 +14,10 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """Perform the setup for Xiaomi/Aqara devices."""
 
     def setup(gateway: Gateway, device: dict, attr: str):
-        async_add_entities([GatewayNumber(gateway, device, attr)])
+        return [GatewayNumber(gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup("number", setup)
+    aqara_gateway.add_setup("number", setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -39,6 +40,8 @@ ENTITY_DESCRIPTIONS: dict[str, NumberEntityDescription] = {
 
 
 class GatewayNumber(GatewayGenericDevice, RestoreNumber):
+    _update_keys = ()
+
     def __init__(self, gateway: Gateway, device: dict, attr: str):
         super().__init__(gateway, device, attr)
         self._attr = attr
@@ -56,4 +59,12 @@ class GatewayNumber(GatewayGenericDevice, RestoreNumber):
 
     async def async_set_native_value(self, value: float) -> None:
         """Set new value."""
-        self.gateway.send(self.device, {self._attr: value})
+        # the numbers are config entities, not user actions. Many devices
+        # never answer a write, so the response is not waited for
+        self.hass.async_create_task(self._async_send(value))
+
+    async def _async_send(self, value: float):
+        """ send the value, a missing response is only logged """
+        if not await self.gateway.async_send(
+                self.device, {self._attr: value}, PRIORITY_BACKGROUND):
+            self.debug("%s write of %s was not confirmed", self._attr, value)
@@ -6,6 +6,7 @@ from homeassistant.helpers.entity import ToggleEntity
 from homeassistant.helpers.debounce import Debouncer
 
 from . import DOMAIN, GatewayGenericDevice
+from .core.const import PRIORITY_BACKGROUND
 from .core.gateway import Gateway
 from .core.utils import Utils
 
@@ -15,10 +16,10 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """ setup config entry """
     def setup(gateway: Gateway, device: dict, attr: str):
-        async_add_entities([GatewayRemote(hass, gateway, device, attr)])
+        return [GatewayRemote(hass, gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('remote', setup)
+    aqara_gateway.add_setup('remote', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -29,6 +30,7 @@ async def async_unload_entry(hass, entry):
 
 class GatewayRemote(GatewayGenericDevice, ToggleEntity):
     """ Gateway Remote """
+    _update_keys = ('pairing_start', 'pairing_stop', 'added_device')
     _state = False
 
     def __init__(
@@ -123,6 +125,8 @@ class GatewayRemote(GatewayGenericDevice, ToggleEntity):
                 self._state = False
                 await self.async_refresh_toggle.async_call()
             elif cmd == 'power':
-                self.gateway.send(self.device, {'power_tx': int(args[1])})
+                self.gateway.send(self.device, {'power_tx': int(args[1])},
+                                  PRIORITY_BACKGROUND)
             elif cmd == 'channel':
-                self.gateway.send(self.device, {'channel': int(args[1])})
+                self.gateway.send(self.device, {'channel': int(args[1])},
+                                  PRIORITY_BACKGROUND)
@@ -14,11 +14,9 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """ Perform the setup for Xiaomi/Aqara devices. """
     def setup(gateway: Gateway, device: dict, attr: str):
         feature = Utils.get_feature_suppported(device["model"])
-        async_add_entities([
-            GatewaySelect(gateway, device, attr, feature)
-        ])
+        return [GatewaySelect(gateway, device, attr, feature)]
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('select', setup)
+    aqara_gateway.add_setup('select', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -29,6 +27,7 @@ async def async_unload_entry(hass, entry):
 
 class GatewaySelect(GatewayGenericDevice, SelectEntity, RestoreEntity):
     """Representation of a Xiaomi/Aqara Select."""
+    _update_keys = ()
     # pylint: disable=unused-argument, too-many-instance-attributes
     def __init__(
         self,
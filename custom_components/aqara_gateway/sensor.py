@@ -66,36 +66,36 @@ async def async_setup_entry(hass, entry, async_add_entities):
     """ setup config entry """
     def setup(gateway: Gateway, device: dict, attr: str):
         if attr == 'gateway':
-            async_add_entities([GatewayStats(gateway, device, attr)])
+            return [GatewayStats(gateway, device, attr)]
         elif attr == 'zigbee':
-            async_add_entities([ZigbeeStats(gateway, device, attr)])
+            return [ZigbeeStats(gateway, device, attr)]
         elif attr == 'last_seen':
-            async_add_entities([GatewayLastSeenSensor(gateway, device, attr)])
+            return [GatewayLastSeenSensor(gateway, device, attr)]
         elif attr == 'gas density':
-            async_add_entities([GatewayGasSensor(gateway, device, attr)])
+            return [GatewayGasSensor(gateway, device, attr)]
         elif attr == 'lock':
-            async_add_entities([GatewayLockSensor(gateway, device, attr)])
+            return [GatewayLockSensor(gateway, device, attr)]
         elif attr == 'key_id':
-            async_add_entities([GatewayKeyIDSensor(gateway, device, attr)])
+            return [GatewayKeyIDSensor(gateway, device, attr)]
         elif attr == 'lock_event':
-            async_add_entities([GatewayLockEventSensor(gateway, device, attr)])
+            return [GatewayLockEventSensor(gateway, device, attr)]
         elif attr in ('hear_rate', 'breath_rate', 'body_movements'):
-            async_add_entities([GatewaySleepMonitorSensor(gateway, device, attr)])
+            return [GatewaySleepMonitorSensor(gateway, device, attr)]
         elif attr == 'illuminance':
             if (device['type'] == 'gateway' and
                     Utils.gateway_illuminance_supported(device['model'])):
-                async_add_entities([GatewaySensor(gateway, device, attr)])
+                return [GatewaySensor(gateway, device, attr)]
             elif device['type'] == 'zigbee':
-                async_add_entities([GatewaySensor(gateway, device, attr)])
+                return [GatewaySensor(gateway, device, attr)]
         elif attr == 'movements':
-            async_add_entities([GatewayMoveSensor(gateway, device, attr)])
+            return [GatewayMoveSensor(gateway, device, attr)]
         elif attr == 'occupancy_region':
-            async_add_entities([GatewayOccupancyRegionSensor(gateway, device, attr)])
+            return [GatewayOccupancyRegionSensor(gateway, device, attr)]
         else:
-            async_add_entities([GatewaySensor(gateway, device, attr)])
+            return [GatewaySensor(gateway, device, attr)]
 
     aqara_gateway: Gateway = hass.data[DOMAIN][entry.entry_id]
-    aqara_gateway.add_setup('sensor', setup)
+    aqara_gateway.add_setup('sensor', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -106,6 +106,7 @@ async def async_unload_entry(hass, entry):
 
 class GatewaySensor(GatewayGenericDevice, SensorEntity):
     """ Xiaomi/Aqara Sensors """
+    _update_keys = (BATTERY, CHIP_TEMPERATURE, LQI, VOLTAGE, LOAD_POWER)
 
     def __init__(
         self,
@@ -196,6 +197,7 @@ class GatewaySensor(GatewayGenericDevice, SensorEntity):
 
 class GatewayLastSeenSensor(GatewaySensor):
     """Last seen timestamp for Aqara devices."""
+    _update_keys = None
     _attr_entity_category = EntityCategory.DIAGNOSTIC
     _attr_entity_registry_enabled_default = False
 
@@ -228,6 +230,8 @@ class GatewayLastSeenSensor(GatewaySensor):
 
 class GatewayGasSensor(GatewaySensor):
     """ Xiaomi/Aqara Gas sensor """
+    _update_keys = ('gas',)
+
     def update(self, data: dict = None):
         """update sensor."""
         if 'gas' in data:
@@ -237,6 +241,7 @@ class GatewayGasSensor(GatewaySensor):
 
 class GatewayStats(GatewaySensor):
     """ Aqara Gateway status """
+    _update_keys = None
     _state = None
     _attrs = None
 
@@ -277,6 +282,7 @@ class GatewayStats(GatewaySensor):
 
 class ZigbeeStats(GatewaySensor):
     """ Aqara Gateway Zigbee status """
+    _update_keys = None
     last_seq1 = None
     last_seq2 = None
     _attrs = None
@@ -340,8 +346,9 @@ class ZigbeeStats(GatewaySensor):
                     self._attrs['last_missed'] = miss
                     if miss:
                         self.debug(
-                            f"Msg missed: {self.last_seq1} => {new_seq1}, "
-                            f"{self.last_seq2} => {new_seq2}, {cluster}"
+                            "Msg missed: %s => %s, %s => %s, %s",
+                            self.last_seq1, new_seq1, self.last_seq2,
+                            new_seq2, cluster
                         )
                 self.last_seq1 = new_seq1
                 self.last_seq2 = new_seq2
@@ -365,6 +372,7 @@ class ZigbeeStats(GatewaySensor):
 class GatewayLockSensor(GatewaySensor):
     # pylint: disable=too-many-instance-attributes
     """Representation of a Aqara Lock."""
+    _update_keys = None
 
     def __init__(self, gateway, device, attr):
         """Initialize the Aqara lock device."""
@@ -443,6 +451,7 @@ class GatewayLockSensor(GatewaySensor):
 
 class GatewayKeyIDSensor(GatewaySensor):
     """Representation of a Aqara Lock Key ID."""
+    _update_keys = None
 
     @property
     def icon(self):
@@ -465,6 +474,7 @@ class GatewayKeyIDSensor(GatewaySensor):
 
 class GatewayLockEventSensor(GatewaySensor):
     """Representation of a Aqara Lock Event."""
+    _update_keys = None
 
     @property
     def icon(self):
@@ -491,6 +501,7 @@ class GatewayLockEventSensor(GatewaySensor):
 class GatewaySleepMonitorSensor(GatewaySensor):
     """Representation of a Aqara Sleep Monitor."""
     # pylint: disable=too-many-instance-attributes
+    _update_keys = ()
 
     @property
     def icon(self):
@@ -515,6 +526,7 @@ class GatewaySleepMonitorSensor(GatewaySensor):
 class GatewayMoveSensor(GatewaySensor):
     """Representation of a Aqara Moving Sensor."""
     # pylint: disable=too-many-instance-attributes
+    _update_keys = ()
 
     @property
     def icon(self):
@@ -548,6 +560,7 @@ class GatewayMoveSensor(GatewaySensor):
 class GatewayOccupancyRegionSensor(GatewaySensor):
     """Representation of a Aqara Occupancy Region Sensor."""
     # pylint: disable=too-many-instance-attributes
+    _update_keys = None
     def __init__(self, gateway, device, attr):
         """Initialize the Aqara lock device."""
         super().__init__(gateway, device, attr)
@@ -29,11 +29,9 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     """ Perform the setup for Xiaomi/Aqara devices. """
     def setup(gateway: Gateway, device: dict, attr: str):
         feature = Utils.get_feature_suppported(device["model"])
-        async_add_entities([
-            GatewaySwitch(gateway, device, attr, feature)
-        ])
+        return [GatewaySwitch(gateway, device, attr, feature)]
     aqara_gateway: Gateway = hass.data[DOMAIN][config_entry.entry_id]
-    aqara_gateway.add_setup('switch', setup)
+    aqara_gateway.add_setup('switch', setup, async_add_entities)
 
 
 async def async_unload_entry(hass, entry):
@@ -44,6 +42,9 @@ async def async_unload_entry(hass, entry):
 
 class GatewaySwitch(GatewayGenericDevice, SwitchEntity, RestoreEntity):
     """Representation of a Xiaomi/Aqara Plug."""
+    _update_keys = (
+        CHIP_TEMPERATURE, FW_VER, 'back_version', LOAD_POWER, LQI,
+        ENERGY_CONSUMED, IN_USE, LOAD_VOLTAGE, *SWITCH_ATTRIBUTES)
 
     def __init__(self, gateway: Gateway, device: dict, attr: str, feature):
         """Initialize the XiaomiPlug."""
@@ -29,4 +29,41 @@ async def system_health_info(hass):
     for i in mqtt:
         data["mqtt_connected"] += "{}\n".format(i)
 
-    return data
\ No newline at end of file
+    data["telnet_sessions"] = ""
+    data["startup_time"] = ""
+    data["mqtt_queue"] = ""
+    data["outbound_queue"] = ""
+    data["write_latency"] = ""
+    for gateway in hass.data[DOMAIN].values():
+        pool = getattr(gateway, 'shell_pool', None)
+        if pool is None:
+            continue
+        data["telnet_sessions"] += (
+            "{}: {} logins, {} reused, {:.1f}s saved\n".format(
+                gateway.host, pool.logins, pool.reuses,
+                pool.login_time_saved))
+        if gateway.cold_start_time is not None:
+            data["startup_time"] += "{}: {:.1f}s\n".format(
+                gateway.host, gateway.cold_start_time)
+        data["mqtt_queue"] += "{}: {} dropped, {} overflows\n".format(
+            gateway.host, gateway.inbox_dropped, gateway.inbox_overflows)
+        queue = gateway.outbound_queue
+        if queue is not None:
+            data["outbound_queue"] += (
+                "{}: {} queued, {} max, {:.0f}ms avg wait, {:.0f}ms max wait, "
+                "{} dropped\n".format(
+                    gateway.host, queue.depth, queue.max_depth,
+                    queue.wait_avg * 1000, queue.wait_max * 1000,
+                    queue.dropped))
+        writes = gateway.pending_writes
+        data["write_latency"] += (
+            "{}: {} confirmed, {} failed, {} timed out, {} retried\n".format(
+                gateway.host, writes.confirmed, writes.failed,
+                writes.timeouts, writes.retried))
+        for model in sorted({d['model'] for d in gateway.devices.values()}):
+            p95 = writes.percentile(model, 0.95)
+            if p95 is not None:
+                data["write_latency"] += "{}: p50 <= {}s, p95 <= {}s\n".format(
+                    model, writes.percentile(model, 0.5), p95)
+
+    return data
\ No newline at end of file
@@ -0,0 +1,5 @@
+""" Tests of the aqara_gateway component, run with pytest from the root """
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
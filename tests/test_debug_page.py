@@ -0,0 +1,22 @@
+""" Pages of the debug log """
+from custom_components.aqara_gateway.core.utils import AqaraGatewayDebug
+
+page = AqaraGatewayDebug.page
+
+
+def test_pages_from_the_end():
+    lines = range(9)
+    assert page(lines, 3) == [6, 7, 8]
+    assert page(lines, 3, 1) == [3, 4, 5]
+    assert page(lines, 3, 2) == [0, 1, 2]
+
+
+def test_partial_last_page():
+    lines = range(5)
+    assert page(lines, 3) == [2, 3, 4]
+    assert page(lines, 3, 1) == [0, 1]
+    assert page(lines, 3, 2) == []
+
+
+def test_generator():
+    assert page((line for line in "abcd"), 10) == list("abcd")
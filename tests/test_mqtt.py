@@ -0,0 +1,156 @@
+""" MQTT framing of the asyncio client against a fake broker """
+import asyncio
+import struct
+
+import pytest
+
+from custom_components.aqara_gateway.core.mqtt import (
+    CONNACK, CONNECT, PUBACK, PUBLISH, SUBSCRIBE, AsyncClient, _packet,
+    _string)
+
+
+def _reader(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+@pytest.mark.parametrize('length', [0, 1, 127, 128, 16383, 16384, 2097152])
+def test_packet_round_trip(length):
+    async def run():
+        body = bytes(i % 256 for i in range(length))
+        return await AsyncClient._read_packet(_reader(_packet(PUBLISH, body)))
+
+    assert asyncio.run(run()) == (PUBLISH, bytes(
+        i % 256 for i in range(length)))
+
+
+class Broker:
+    """ accepts one client, answers CONNECT and records the packets """
+
+    def __init__(self):
+        self.packets = asyncio.Queue()
+        self.writer = None
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self._handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader, writer):
+        self.writer = writer
+        try:
+            while True:
+                packet = await AsyncClient._read_packet(reader)
+                if packet[0] == CONNECT:
+                    writer.write(_packet(CONNACK, bytes([0, 0])))
+                await self.packets.put(packet)
+        except asyncio.IncompleteReadError:
+            pass
+
+    def publish(self, topic, payload: bytes, header: int = PUBLISH):
+        body = topic if isinstance(topic, bytes) else _string(topic)
+        if header & 0x06:
+            body += struct.pack("!H", 7)
+        self.writer.write(_packet(header, body + payload))
+
+    def stop(self):
+        if self.writer:
+            self.writer.close()
+        self.server.close()
+
+
+async def _connect(messages, lost):
+    broker = Broker()
+    await broker.start()
+    client = AsyncClient(asyncio.get_running_loop())
+    client.on_message = lambda client, userdata, msg: messages.put_nowait(
+        msg)
+    client.on_disconnect = lambda client, userdata, ret: lost.set()
+    assert await client.async_connect('127.0.0.1', broker.port) == 0
+    header, body = await broker.packets.get()
+    assert header == CONNECT and body.startswith(_string("MQTT"))
+    client.loop_start()
+    return broker, client
+
+
+def test_subscribe_and_publish():
+    async def run():
+        messages, lost = asyncio.Queue(), asyncio.Event()
+        broker, client = await _connect(messages, lost)
+
+        client.subscribe([('zigbee/send', 0), ('ioctl/send', 1)])
+        header, body = await broker.packets.get()
+        assert header == SUBSCRIBE
+        assert body[2:] == _string('zigbee/send') + b"\x00" + \
+            _string('ioctl/send') + b"\x01"
+
+        client.publish('zigbee/recv', b'{"cmd":"write"}')
+        assert await broker.packets.get() == (
+            PUBLISH, _string('zigbee/recv') + b'{"cmd":"write"}')
+
+        broker.publish('zigbee/send', b'{"cmd":"report"}')
+        msg = await messages.get()
+        assert (msg.topic, msg.payload, msg.qos) == (
+            'zigbee/send', b'{"cmd":"report"}', 0)
+
+        # QoS 1 is acknowledged with its packet id
+        broker.publish('ioctl/send', b'x', PUBLISH | 0x02)
+        msg = await messages.get()
+        assert (msg.topic, msg.payload, msg.qos) == ('ioctl/send', b'x', 1)
+        assert await broker.packets.get() == (PUBACK, struct.pack("!H", 7))
+
+        client.loop_stop()
+        broker.stop()
+        assert not lost.is_set()
+
+    asyncio.run(run())
+
+
+def test_malformed_publish_is_skipped():
+    async def run():
+        messages, lost = asyncio.Queue(), asyncio.Event()
+        broker, client = await _connect(messages, lost)
+
+        broker.publish(_string(b"\xff\xfe"), b'bad topic')
+        broker.publish(struct.pack("!H", 50) + b"short", b'')
+        broker.publish('zigbee/send', b'good')
+        msg = await asyncio.wait_for(messages.get(), 1)
+        assert (msg.topic, msg.payload) == ('zigbee/send', b'good')
+        assert messages.empty() and not lost.is_set()
+
+        client.loop_stop()
+        broker.stop()
+
+    asyncio.run(run())
+
+
+def test_lost_connection_calls_on_disconnect():
+    async def run():
+        messages, lost = asyncio.Queue(), asyncio.Event()
+        broker, client = await _connect(messages, lost)
+        broker.stop()
+        await asyncio.wait_for(lost.wait(), 1)
+        assert not client.connected
+
+    asyncio.run(run())
+
+
+def test_failed_handler_calls_on_disconnect():
+    async def run():
+        messages, lost = asyncio.Queue(), asyncio.Event()
+        broker, client = await _connect(messages, lost)
+
+        def fail(client, userdata, msg):
+            raise RuntimeError("handler failed")
+
+        client.on_message = fail
+        broker.publish('zigbee/send', b'x')
+        await asyncio.wait_for(lost.wait(), 1)
+        assert not client.connected
+        broker.stop()
+
+    asyncio.run(run())
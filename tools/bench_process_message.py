@@ -0,0 +1,124 @@
+""" Benchmark of Gateway._process_message throughput
+
+Run from the repository root with Home Assistant and paho-mqtt installed:
+
+    python tools/bench_process_message.py [-n 20000]
+
+The numbers are for the tree which is checked out, run it on two commits
+to compare before and after a change.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from custom_components.aqara_gateway.core.const import DOMAIN, DOMAINS
+from custom_components.aqara_gateway.core.gateway import Gateway
+
+DEVICES = [{
+    'did': 'lumi.158d0001000001',
+    'mac': '0x158d0001000001',
+    'model': 'lumi.plug.maeu01',
+    'type': 'zigbee',
+}, {
+    'did': 'lumi.158d0001000002',
+    'mac': '0x158d0001000002',
+    'model': 'lumi.weather',
+    'type': 'zigbee',
+}, {
+    'did': 'lumi.158d0001000003',
+    'mac': '0x158d0001000003',
+    'model': 'lumi.airrtc.vrfegl01',
+    'type': 'zigbee',
+}]
+
+MESSAGES = [{
+    'cmd': 'report',
+    'did': 'lumi.158d0001000001',
+    'params': [
+        {'res_name': '0.12.85', 'value': 12.34},
+        {'res_name': '0.13.85', 'value': 4567},
+        {'res_name': '4.1.85', 'value': 1},
+    ],
+}, {
+    'cmd': 'report',
+    'did': 'lumi.158d0001000002',
+    'params': [
+        {'res_name': '0.1.85', 'value': 2150},
+        {'res_name': '0.2.85', 'value': 4530},
+        {'res_name': '0.3.85', 'value': 100120},
+    ],
+}, {
+    'cmd': 'heartbeat',
+    'params': [{
+        'did': 'lumi.158d0001000002',
+        'res_list': [
+            {'res_name': '8.0.2001', 'value': 3000},
+            {'res_name': '8.0.2007', 'value': 200},
+            {'res_name': '8.0.2008', 'value': 3000},
+        ],
+    }],
+}, {
+    'cmd': 'report',
+    'did': 'lumi.158d0001000003',
+    'params': [
+        {'res_name': '0.8.85', 'value': 2400},
+        {'res_name': '1.8.85', 'value': 2300},
+        {'res_name': '4.8.85', 'value': 1},
+        {'res_name': '14.8.85', 'value': 2},
+        {'res_name': '14.147.85', 'value': 1},
+    ],
+}]
+
+
+async def main(count: int, config_dir: str):
+    """ set up the devices and feed the messages """
+    loop = asyncio.get_running_loop()
+    hass = SimpleNamespace(
+        data={DOMAIN: {}},
+        loop=loop,
+        create_task=loop.create_task,
+        # the storage helpers of hass read the config dir
+        config=SimpleNamespace(
+            config_dir=config_dir,
+            path=lambda *path: os.path.join(config_dir, *path)),
+    )
+    entry = SimpleNamespace(entry_id='bench', options={
+        'host': '127.0.0.1',
+        'model': 'lumi.gateway.iragl5',
+        'vrf_units': [8],
+    })
+    gateway = Gateway(hass, entry, config={'devices': {}})
+    for domain in DOMAINS:
+        gateway.add_setup(domain, lambda *args: None, lambda entities: None)
+    start = time.perf_counter()
+    await gateway.async_setup_devices([dict(device) for device in DEVICES])
+    print(f"{len(DEVICES)} devices set up in "
+          f"{time.perf_counter() - start:.3f} s")
+
+    received = []
+    for device in DEVICES:
+        gateway.add_update(device['did'], received.append)
+
+    messages = [MESSAGES[i % len(MESSAGES)] for i in range(count)]
+    start = time.perf_counter()
+    for message in messages:
+        gateway._process_message(message)
+    elapsed = time.perf_counter() - start
+
+    print(f"{count} messages in {elapsed:.3f} s, "
+          f"{count / elapsed:.0f} messages/sec, "
+          f"{len(received)} updates")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=20000)
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(parser.parse_args().count, tmp))
@@ -0,0 +1,103 @@
+""" Replay of a MQTT capture through Gateway._on_message
+
+The capture is written by the gateway with the record option of the YAML
+config. Run from the repository root with Home Assistant and paho-mqtt
+installed:
+
+    python tools/replay.py capture.rec --devices .storage/aqara_gateway.<entry>.devices
+    python tools/replay.py capture.rec --devices ... --speed 1 --output updates.jsonl
+
+The devices are the list stored by the gateway, without them the reports
+are not decoded. Speed 0 replays as fast as possible and prints the
+throughput, else the recorded timing is kept divided by the speed. The
+output has one line per entity update, diff it between two commits to find
+the changes of the converted values.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from custom_components.aqara_gateway.core.const import DOMAIN, DOMAINS
+from custom_components.aqara_gateway.core.gateway import Gateway
+from custom_components.aqara_gateway.core.mqtt import MQTTMessage
+from custom_components.aqara_gateway.core.recorder import read_capture
+
+
+def load_devices(path: str) -> dict:
+    """ the stored data of the gateway, the storage file or its data """
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    return data.get('data', data)
+
+
+async def main(args, config_dir: str):
+    """ set up the devices and feed the capture """
+    loop = asyncio.get_running_loop()
+    hass = SimpleNamespace(
+        data={DOMAIN: {}},
+        loop=loop,
+        create_task=loop.create_task,
+        # the Store of the device list reads the config dir
+        config=SimpleNamespace(
+            config_dir=config_dir,
+            path=lambda *path: os.path.join(config_dir, *path)),
+    )
+    stored = load_devices(args.devices) if args.devices else {}
+    entry = SimpleNamespace(entry_id='replay', options={
+        'host': '127.0.0.1',
+        'model': stored.get('model', ''),
+    })
+    gateway = Gateway(hass, entry, config={'devices': {}})
+    gateway.cloud = stored.get('cloud') or gateway.cloud
+    for domain in DOMAINS:
+        gateway.add_setup(domain, lambda *args: None, lambda entities: None)
+    await gateway.async_setup_devices(stored.get('devices', []))
+
+    updates = []
+    for did in list(gateway.devices):
+        gateway.add_update(
+            did, lambda payload, did=did: updates.append((did, payload)))
+
+    count = 0
+    start = time.perf_counter()
+    first = None
+    for created, topic, payload in read_capture(args.capture):
+        if args.speed > 0:
+            if first is None:
+                first = created
+            delay = (created - first) / args.speed - (
+                time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        gateway._on_message(MQTTMessage(topic, payload))
+        count += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{count} messages in {elapsed:.3f} s, "
+          f"{count / elapsed if elapsed else 0:.0f} messages/sec, "
+          f"{len(updates)} updates")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            for did, payload in updates:
+                file.write(json.dumps(
+                    {'did': did, 'payload': payload}, default=str) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture')
+    parser.add_argument('--devices', help="stored devices of the gateway")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="0 is as fast as possible, 1 is the recorded")
+    parser.add_argument('--output', help="file of the entity updates")
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(main(parser.parse_args(), tmp))